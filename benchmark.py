@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import yaml
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import statistics
+from onepagepoints import Weapon, Unit, weapon_cost_cache, unit_rules_cache
+import onepagebatch
+from onepagebatch import Faction, upgrade_cost_cache, DumpTxt, DumpHtml, DumpTex, FactionView
+from generate_synthetic import generate
+import onepagecache
+
+"""
+Benchmarks for the points engine and the renderers.
+Each benchmark runs on the real factions, and on synthetic factions where all
+units are duplicated "scale" times (and all upgrade groups apply to the copies).
+Random factions of any size can also be generated with generate_synthetic.py.
+Results can be saved as a json baseline, and compared to a previous one to
+find performance regressions.
+"""
+
+default_factions = ['Battle_Brothers', 'High_Elf_Fleets', 'Robot_Legions', 'Tao', 'Orc']
+
+
+# Run func "repeat" times, return the min and median time in seconds
+def timeit(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+# Write a copy of a faction in directory "dest", with all units duplicated "scale" times
+def scaled_faction(name, scale, dest):
+    def load(filename):
+        return onepagecache.load_yaml(os.path.join(name, filename))
+
+    def copies(unit_names):
+        return [u if k == 0 else '{} {}'.format(u, k) for k in range(scale) for u in unit_names]
+
+    yfaction = load('faction.yml')
+    yfaction['pages'] = [copies(page) for page in yfaction['pages']]
+
+    yunits = []
+    for k in range(scale):
+        for yunit in load('units.yml'):
+            if k:
+                yunit['name'] = '{} {}'.format(yunit['name'], k)
+            yunits.append(yunit)
+
+    yupgrades = load('upgrades.yml')
+    for group in yupgrades:
+        group['units'] = copies(group['units'])
+
+    path = os.path.join(dest, '{}_x{}'.format(name, scale))
+    os.makedirs(path, exist_ok=True)
+    for filename, data in [('faction.yml', yfaction), ('units.yml', yunits), ('upgrades.yml', yupgrades), ('equipments.yml', load('equipments.yml'))]:
+        with open(os.path.join(path, filename), 'w') as f:
+            yaml.safe_dump(data, f)
+    return path
+
+
+# Generate a random faction with "units" units in directory "dest", other sizes are
+# proportional to the number of units
+def synthetic_faction(units, dest):
+    path = os.path.join(dest, 'Synthetic_{}'.format(units))
+    generate(path, 'Synthetic', units, max(units // 2, 1), max(units // 50, 1), max(units // 50, 1),
+             min(max(units // 20, 1), 300), 4, 2, 0)
+    return path
+
+
+# Forget all costs, parsed rules, yaml documents and templates kept in memory,
+# so the next run is a cold one. Weapon rules are compiled for each Weapon, so they
+# are not cached between runs.
+def invalidate_caches():
+    weapon_cost_cache.invalidate()
+    unit_rules_cache.invalidate()
+    upgrade_cost_cache.invalidate()
+    onepagecache.yaml_cache.invalidate()
+    onepagebatch.templates.clear()
+
+
+# All benchmarks for one faction, return {benchmark name: timing}
+# Benchmarks named "cached" run with the caches filled by the previous runs,
+# the others start with empty caches.
+def bench_faction(path, repeat):
+    results = {}
+
+    def faction():
+        return quiet(Faction, path)
+
+    def faction_cold():
+        invalidate_caches()
+        return faction()
+
+    results['Faction'] = timeit(faction_cold, repeat)
+    results['Faction cached'] = timeit(faction, repeat)
+    f = faction()
+
+    weapons = [w for w in f.armory.values() if isinstance(w, Weapon)]
+    speeds = [8, 12, 14.4, 18, 24]
+
+    def weapon_cost():
+        weapon_cost_cache.invalidate()
+        for w in weapons:
+            for speed in speeds:
+                for quality in range(2, 7):
+                    w.Cost(speed, quality)
+
+    def weapon_cost_cached():
+        for w in weapons:
+            for speed in speeds:
+                for quality in range(2, 7):
+                    w.Cost(speed, quality)
+
+    results['Weapon.Cost'] = timeit(weapon_cost, repeat)
+    results['Weapon.Cost cached'] = timeit(weapon_cost_cached, repeat)
+
+    def unit_cost():
+        weapon_cost_cache.invalidate()
+        for unit in f.units:
+            unit.Cost()
+
+    results['Unit.Cost'] = timeit(unit_cost, repeat)
+
+    groups = [(group, [unit for unit in f.units if unit.name in group.units]) for group in f.upgrades]
+
+    def upgrade_cost_cached():
+        for group, units in groups:
+            for upgrade in group:
+                upgrade.Cost(units)
+
+    def upgrade_cost():
+        weapon_cost_cache.invalidate()
+        upgrade_cost_cache.invalidate()
+        upgrade_cost_cached()
+
+    results['Upgrade.Cost'] = timeit(upgrade_cost, repeat)
+    results['Upgrade.Cost cached'] = timeit(upgrade_cost_cached, repeat)
+
+    for dump in [DumpTxt, DumpHtml, DumpTex]:
+        def render():
+            dump().write(FactionView(f), io.StringIO())
+        results[dump.__name__] = timeit(render, repeat)
+
+    return results
+
+
+# Same class as cls, without __slots__: attributes are stored in a __dict__, like
+# before the classes used __slots__
+def unslotted(cls):
+    namespace = {k: v for k, v in vars(cls).items() if k != '__slots__' and k not in cls.__slots__}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+# Memory used by one Weapon and one Unit, in bytes, with and without __slots__
+def bench_memory(n=20000):
+    def measure(weaponClass, unitClass):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        weapons = [weaponClass('Rifle', 24, i % 5 + 1, 1, ['Rending']) for i in range(n)]
+        middle = tracemalloc.get_traced_memory()[0]
+        units = [unitClass('Grunt', 5, 4, 4, [weapons[i]], ['Scout']) for i in range(n)]
+        end = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del weapons, units
+        return (middle - start) / n, (end - middle) / n
+
+    weapon, unit = measure(Weapon, Unit)
+    weaponDict, unitDict = measure(unslotted(Weapon), unslotted(Unit))
+    return {'Weapon bytes': weapon, 'Weapon bytes without slots': weaponDict, 'Weapon bytes saved': weaponDict - weapon,
+            'Unit bytes': unit, 'Unit bytes without slots': unitDict, 'Unit bytes saved': unitDict - unit}
+
+
+def run(factions, scales, synthetics, repeat):
+    results = {}
+
+    def bench(name, path):
+        for bench, timing in bench_faction(path, repeat).items():
+            key = '{}/{}'.format(name, bench)
+            results[key] = timing
+            print('{:<45} {:10.3f} ms {:10.3f} ms'.format(key, timing['min'] * 1000, timing['median'] * 1000))
+
+    if any(scale > 1 for scale in scales):
+        print('The copies of a unit in the xN factions have the same cache keys, so their costs are\n'
+              'computed once per run, and the xN rows measure the cache hits of the copies.')
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in factions:
+            for scale in scales:
+                bench('{} x{}'.format(name, scale), name if scale == 1 else scaled_faction(name, scale, tmp))
+        for units in synthetics:
+            bench('Synthetic {}'.format(units), synthetic_faction(units, tmp))
+    return results
+
+
+# Return the list of benchmarks slower than the baseline by more than threshold (0.1 is 10%)
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, timing in sorted(results.items()):
+        if key not in baseline:
+            continue
+        old = baseline[key]['min']
+        new = timing['min']
+        ratio = new / old if old else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(key)
+        print('{:<45} {:10.3f} ms -> {:10.3f} ms {:+7.1f}% {}'.format(key, old * 1000, new * 1000, (ratio - 1) * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the points computation and the renderers')
+    parser.add_argument('factions', type=str, nargs='*', default=default_factions,
+                        help='factions to benchmark')
+    parser.add_argument('-s', '--scale', type=int, nargs='+', default=[1, 10],
+                        help='number of copies of each unit, for the synthetic factions')
+    parser.add_argument('-g', '--synthetic', type=int, nargs='*', default=[],
+                        help='number of units of the random factions to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of runs of each benchmark, the fastest is kept')
+    parser.add_argument('-o', '--output', type=str,
+                        help='save the results as a json baseline')
+    parser.add_argument('-c', '--compare', type=str,
+                        help='json baseline to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=10,
+                        help='slowdown in percent, to report a regression')
+
+    args = parser.parse_args()
+
+    # Don't measure the disk cache of yaml files, only the in memory one.
+    onepagecache.yaml_cache.path = None
+
+    results = run(args.factions, args.scale, args.synthetic, args.repeat)
+    memory = bench_memory()
+    for key, size in memory.items():
+        print('{:<45} {:10.1f}'.format(key, size))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results, 'memory': memory}, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\nComparison with {}'.format(args.compare))
+        if compare(results, baseline['results'], args.threshold / 100):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import subprocess
+from onepagebatch import generateFactions
+from onepagecache import BuildCache
+
+"""
+Build all faction pdf in one command.
+The points are computed in this process once for all factions, then xelatex
+runs on each generated .tex file. xelatex is skipped when the .tex file didn't
+change since the last pdf, and the xelatex jobs are started only when they fit
+in the memory budget, so they don't fail randomly when RAM runs short.
+Failed xelatex jobs are retried alone.
+"""
+
+default_factions = ['Battle_Brothers', 'Tao', 'Robot_Legions', 'High_Elf_Fleets', 'Orc']
+
+# for reproducible build
+latex_env = dict(os.environ)
+latex_env.setdefault('SOURCE_DATE_EPOCH', '0')
+
+
+# Available memory in MB, or None if it's unknown (not on Linux)
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+# Biggest memory used by a finished child process in MB
+def children_peak_memory():
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kB elsewhere
+    if sys.platform == 'darwin':
+        return peak // (1024 * 1024)
+    return peak // 1024
+
+
+def tex_hash(texfile):
+    with open(texfile, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class PdfJob:
+    def __init__(self, faction, build_dir, latex):
+        self.faction = faction
+        self.texdir = os.path.join(build_dir, 'tex')
+        self.tex = os.path.join(self.texdir, faction + '.tex')
+        self.pdf = os.path.join(build_dir, faction + '.pdf')
+        self.stamp = os.path.join(self.texdir, faction + '.sha256')
+        self.latex = latex
+        self.hash = tex_hash(self.tex)
+        self.tries = 0
+        self.process = None
+
+    # the pdf is up to date if it was built from the same .tex
+    def upToDate(self):
+        if not os.path.exists(self.pdf) or not os.path.exists(self.stamp):
+            return False
+        with open(self.stamp) as f:
+            return f.read().strip() == self.hash
+
+    def start(self):
+        self.tries += 1
+        print('Generating {}{}'.format(self.pdf, ' (retry {})'.format(self.tries - 1) if self.tries > 1 else ''))
+        cmd = self.latex + ['-interaction=batchmode', '-halt-on-error', self.faction + '.tex']
+        try:
+            self.process = subprocess.Popen(cmd, cwd=self.texdir, env=latex_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            print('Error running {}: {}'.format(cmd[0], e))
+            self.process = None
+
+    # return None if still running, else True if the pdf was generated
+    def poll(self):
+        if self.process is None:
+            return False
+        ret = self.process.poll()
+        if ret is None:
+            return None
+        built = os.path.join(self.texdir, self.faction + '.pdf')
+        if ret != 0 or not os.path.exists(built):
+            print('Error generating {}, xelatex returned {}, see {}'.format(self.pdf, ret, os.path.join(self.texdir, self.faction + '.log')))
+            return False
+        shutil.move(built, self.pdf)
+        with open(self.stamp, 'w') as f:
+            f.write(self.hash)
+        return True
+
+
+# Run the jobs, a new job is started only if the memory of the running jobs
+# plus its own stays under "budget" MB. job_memory is the expected memory of a
+# job, updated with the biggest memory really used by finished jobs.
+# A failed job is retried up to "retries" times, alone so it has all the memory.
+# return the list of failed jobs
+def runJobs(jobs, budget, job_memory, retries):
+    pending = list(jobs)
+    running = []
+    failed = []
+
+    while pending or running:
+        while pending:
+            job = pending[0]
+            if running and (job.tries or (len(running) + 1) * job_memory > budget):
+                break
+            available = available_memory()
+            if running and available is not None and available < job_memory:
+                break
+            pending.pop(0)
+            job.start()
+            running.append(job)
+
+        time.sleep(0.05)
+        for job in list(running):
+            result = job.poll()
+            if result is None:
+                continue
+            running.remove(job)
+            job_memory = max(job_memory, children_peak_memory())
+            if result:
+                continue
+            if job.process is not None and job.tries <= retries:
+                pending.append(job)
+            else:
+                failed.append(job)
+    return failed
+
+
+def main():
+    available = available_memory()
+    default_budget = available * 3 // 4 if available else 2048
+
+    parser = argparse.ArgumentParser(description='Build the pdf of all factions, computing the points once and running xelatex only when needed')
+    parser.add_argument('-b', '--build-dir', type=str, default='build',
+                        help='directory to write the output files')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of factions to compute in parallel')
+    parser.add_argument('-m', '--memory', type=int, default=default_budget,
+                        help='memory budget for all xelatex jobs in MB (default is 3/4 of the available memory)')
+    parser.add_argument('--job-memory', type=int, default=500,
+                        help='expected memory of one xelatex job in MB, it is updated with the real usage')
+    parser.add_argument('-r', '--retries', type=int, default=2,
+                        help='number of retries of a failed xelatex job')
+    parser.add_argument('--latex', type=str, default='xelatex',
+                        help='LaTeX command')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always recompute the factions, without using the build cache')
+    parser.add_argument('factions', type=str, nargs='*', default=default_factions,
+                        help='path to the faction (should contain at list equipments.yml, units.yml, upgrades.yml)')
+
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else BuildCache()
+    factions = [faction.strip('/') for faction in args.factions]
+
+    failed = generateFactions(factions, args.build_dir, ['txt', 'html', 'tex'], args.jobs, cache=cache)
+
+    jobs = []
+    for faction in factions:
+        if faction in failed:
+            continue
+        job = PdfJob(faction, args.build_dir, args.latex.split())
+        if job.upToDate():
+            print('{} is up to date'.format(job.pdf))
+        else:
+            jobs.append(job)
+    failed += [job.faction for job in runJobs(jobs, args.memory, args.job_memory, args.retries)]
+
+    if failed:
+        print('Failed factions: {}'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
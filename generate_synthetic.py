@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import math
+import random
+import argparse
+from string import ascii_uppercase
+from indentyaml import YamlUnit, YamlUpgrade, format_equipments, format_faction, format_units, format_upgrades
+
+"""
+This scripts generates a random faction, to test the scripts on big factions.
+The weapons, wargear, units and upgrades look like the real ones, and the
+generated yaml files have the same format as the one from indentyaml.py.
+With the same seed and options, the faction is always the same.
+"""
+
+ranges = [0, 0, 0, 6, 12, 12, 18, 24, 24, 30, 36, 48]
+attacks = [1, 1, 1, 2, 2, 3, 4, 6, 'D3', 'D6', 'D3+1']
+aps = [0, 0, 0, 1, 1, 2, 3, 4]
+weapon_rules = ['Deadly', 'Rending', 'Blast(3)', 'Blast(6)', 'Limited', 'Indirect', 'Sniper',
+                'Poison(3)', 'Impact(3)', 'Anti-Air', 'Flux', 'Secondary', 'Linked', 'EMP']
+unit_rules = ['Hero', 'Fearless', 'Scout', 'Ambush', 'Fast', 'Slow', 'Strider', 'Flying', 'Stealth',
+              'Good Shot', 'Bad Shot', 'Furious', 'Regeneration', 'Inspiring', 'Tough(3)', 'Tough(6)',
+              'Psychic(1)', 'Psychic(2)', 'Defense+1']
+vehicle_rules = ['Vehicle', 'Monster', 'Titan', 'Transport(6)', 'Transport(11)', 'Very Fast', 'Flyer', 'Airdrop']
+gear_rules = ['Fast', 'Stealth', 'Defense+1', 'Fearless', 'Beacon', 'Psychic+1', 'Transport+2', 'Regeneration']
+adjectives = ['Heavy', 'Light', 'Assault', 'Plasma', 'Pulse', 'Fusion', 'Gatling', 'Shard', 'Ion',
+              'Rail', 'Grav', 'Storm', 'Sniper', 'Flame', 'Frag', 'Twin', 'Power', 'Energy']
+nouns = ['Rifle', 'Carbine', 'Cannon', 'Pistol', 'Blade', 'Claw', 'Launcher', 'Gun', 'Hammer',
+         'Spear', 'Lance', 'Axe', 'Mortar', 'Beamer', 'Fist', 'Whip', 'Caster', 'Mine']
+
+
+# Name is unique thanks to the index, and never ends with 's', so plurals can be resolved
+def name(rng, index, words):
+    return '{} {} {}'.format(rng.choice(adjectives), rng.choice(words), index)
+
+
+def sample_rules(rng, rules, mean):
+    count = min(len(rules), int(rng.expovariate(1 / mean)) if mean else 0)
+    return sorted(rng.sample(rules, count))
+
+
+def gen_weapons(rng, n):
+    weapons = {}
+    for i in range(n):
+        weapon = {'range': rng.choice(ranges), 'attacks': rng.choice(attacks), 'ap': rng.choice(aps)}
+        special = sample_rules(rng, weapon_rules, 0.8)
+        if special:
+            weapon['special'] = special
+        weapons[name(rng, i, nouns)] = {k: v for k, v in weapon.items() if v}
+    return weapons
+
+
+def gen_wargear(rng, n, weapons):
+    wargear = {}
+    ranged = [w for w, data in weapons.items() if data.get('range')]
+    for i in range(n):
+        gear = {'special': sample_rules(rng, gear_rules, 1)}
+        if ranged and rng.random() < 0.5:
+            gear['weapons'] = ['Linked ' + rng.choice(ranged)]
+        wargear['{} Gear {}'.format(rng.choice(adjectives), i)] = gear
+    return wargear
+
+
+# "base" is the first equipment of the unit, taken from a small set, so many
+# units can share a "Replace" upgrade
+def gen_units(rng, n, weapons, wargear, base):
+    units = []
+    for i in range(n):
+        vehicle = rng.random() < 0.15
+        count = 1 if vehicle else rng.choice([1, 1, 3, 5, 5, 10])
+        equipment = [rng.choice(base)]
+        for w in rng.sample(weapons, min(len(weapons), rng.randint(0, 2))):
+            equipment.append(rng.choice([w, w, '2x ' + w, w + 's' if count > 1 else w]))
+        if wargear and rng.random() < 0.2:
+            equipment.append(rng.choice(wargear))
+        special = sample_rules(rng, unit_rules, 1.5)
+        if vehicle:
+            special += sample_rules(rng, vehicle_rules, 1.5) or ['Vehicle']
+        units.append(YamlUnit({'name': 'Unit {}'.format(i), 'count': count, 'quality': rng.randint(2, 6),
+                               'defense': rng.randint(2, 9 if vehicle else 6), 'equipment': equipment,
+                               'special': sorted(set(special))}))
+    return units
+
+
+def gen_upgrade(rng, units, weapons, wargear, options):
+    add = [rng.sample(weapons + wargear, rng.randint(1, 2)) for i in range(options)]
+    upgrade = {'text': 'Upgrade any model with one', 'add': add}
+    shared = set(units[0]['equipment'][:1])
+    for unit in units[1:]:
+        shared &= set(unit['equipment'][:1])
+    if shared and rng.random() < 0.5:
+        remove = shared.pop()
+        upgrade['text'] = 'Replace ' + remove
+        upgrade['remove'] = [remove]
+    if all(unit['count'] > 1 for unit in units) and rng.random() < 0.3:
+        upgrade['text'] = upgrade['text'].replace('any model', 'all models')
+        upgrade['all'] = True
+    return YamlUpgrade(upgrade)
+
+
+# Each page can't have more than 26 upgrade groups (named A to Z), so groups only
+# use units from one page
+def gen_upgrades(rng, pages, units, weapons, wargear, groups, group_size, options):
+    byname = {unit['name']: unit for unit in units}
+    upgrades = []
+    for g in range(groups):
+        page = pages[g % len(pages)]
+        base = rng.choice([byname[u]['equipment'][0] for u in page])
+        candidates = [u for u in page if byname[u]['equipment'][0] == base]
+        if len(candidates) < group_size:
+            taken = set(candidates)
+            candidates += rng.sample([u for u in page if u not in taken], min(group_size, len(page)) - len(candidates))
+        gunits = sorted(rng.sample(candidates, min(group_size, len(candidates))), key=lambda u: int(u.split()[-1]))
+        gupgrades = [gen_upgrade(rng, [byname[u] for u in gunits], weapons, wargear, options) for i in range(rng.randint(1, 3))]
+        upgrades.append({'units': gunits, 'upgrades': gupgrades})
+    return upgrades
+
+
+def generate(path, title, n_units, n_weapons, n_wargear, groups, group_size, options, n_pages, seed):
+    rng = random.Random(seed)
+    n_pages = max(n_pages, math.ceil(groups / len(ascii_uppercase)))
+
+    weapons = gen_weapons(rng, n_weapons)
+    wargear = gen_wargear(rng, n_wargear, weapons)
+    names = list(weapons)
+    base = rng.sample(names, min(len(names), 20))
+    units = gen_units(rng, n_units, names, list(wargear), base)
+
+    unit_names = [unit['name'] for unit in units]
+    size = math.ceil(len(unit_names) / n_pages)
+    pages = [unit_names[p * size:(p + 1) * size] for p in range(n_pages)]
+    pages = [page for page in pages if page]
+    upgrades = gen_upgrades(rng, pages, units, names, list(wargear), groups, group_size, options)
+
+    faction = {'title': title, 'pages': pages}
+    for p in range(len(pages)):
+        faction['specialRules' + str(p + 1)] = {'Inspiring': 'Friendly units within 12" may use this model quality for morale tests.'}
+        faction['psychics' + str(p + 1)] = {4: {'Bolt': 'Target enemy unit within 24" takes 1 hit with AP(1).'}}
+
+    equipments = {'weapons': weapons, 'wargear': wargear, 'factionRules': {'Inspiring': 5}}
+
+    os.makedirs(path, exist_ok=True)
+    for filename, func, data in [('faction.yml', format_faction, faction), ('equipments.yml', format_equipments, equipments),
+                                 ('units.yml', format_units, units), ('upgrades.yml', format_upgrades, upgrades)]:
+        with open(os.path.join(path, filename), 'w') as f:
+            f.write(func(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a random faction, to test big factions')
+    parser.add_argument('path', type=str,
+                        help='directory of the generated faction')
+    parser.add_argument('-u', '--units', type=int, default=100,
+                        help='number of units')
+    parser.add_argument('-w', '--weapons', type=int, default=100,
+                        help='number of weapons')
+    parser.add_argument('--wargear', type=int, default=10,
+                        help='number of wargear')
+    parser.add_argument('-g', '--groups', type=int, default=20,
+                        help='number of upgrade groups')
+    parser.add_argument('--group-size', type=int, default=5,
+                        help='number of units of each upgrade group')
+    parser.add_argument('--options', type=int, default=4,
+                        help='number of options of each upgrade')
+    parser.add_argument('-p', '--pages', type=int, default=2,
+                        help='number of pages (more pages are added if there are more than 26 groups per page)')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='seed of the random generator')
+
+    args = parser.parse_args()
+
+    title = 'Synthetic {} units seed {}'.format(args.units, args.seed)
+    generate(args.path, title, args.units, args.weapons, args.wargear, args.groups,
+             args.group_size, args.options, args.pages, args.seed)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -25,6 +25,7 @@ import os
 import yaml
 import argparse
 from collections import OrderedDict
+from onepagecache import YamlLoader
 
 """
 This scripts helps to indent the yaml files for each faction
@@ -120,7 +121,7 @@ def format_file(filename, path, format_func):
     print('processing {0}'.format(floc))
     with open(floc, "r") as f:
         rawdata = f.read()
-        data = yaml.load(rawdata)
+        data = yaml.load(rawdata, Loader=YamlLoader)
 
     newdata = format_func(data)
 
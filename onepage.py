@@ -22,8 +22,9 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 
-from onepagebatch import generateFaction
-import os
+from onepagebatch import generateFactions
+from onepagecache import BuildCache
+import sys
 import argparse
 
 
@@ -31,13 +32,21 @@ def main():
     default_factions = ['Battle_Brothers', 'High_Elf_Fleets', 'Robot_Legions', 'Tao', 'Orc']
 
     parser = argparse.ArgumentParser(description='This script will compute the Unit costs and upgrade costs for a faction, and write html output')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of factions to build in parallel')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always rebuild the factions, without using the build cache')
+    parser.add_argument('--profile', type=str, metavar='TRACE',
+                        help='print the time of each build phase, and write a Chrome trace to TRACE (json)')
     parser.add_argument('factions', type=str, nargs='*', default=default_factions,
                         help='path to the faction (should contain at list equipments.yml, units.yml, upgrades.yml)')
 
     args = parser.parse_args()
 
-    for faction in args.factions:
-        generateFaction(faction)
+    cache = None if args.no_cache else BuildCache()
+
+    if generateFactions(args.factions, jobs=args.jobs, cache=cache, profile=args.profile):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -23,13 +23,24 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
 from onepagepoints import *
-import yaml
+from onepagecache import BuildCache, hash_inputs, default_cache_dir, default_cache_size, load_yaml, log_name
+from onepageprofile import profiler, report
+import onepagepoints
+import onepagecache
+import onepageprofile
 import os
+import io
+import sys
 import copy
+import time
 import argparse
+import shutil
 import pathlib
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from string import ascii_uppercase
-from collections import OrderedDict
+from collections import namedtuple
 
 
 # return pretty string for points
@@ -55,16 +66,28 @@ def prettyName(unit):
     return unit.name
 
 
-# Return a pretty string of the list of equipments
-def PrettyEquipments(equipments):
-    equWithCount = list(OrderedDict.fromkeys([(equ, equipments.count(equ)) for equ in equipments]))
-    return [pCount(c) + e.name + ' ' + e.Profile() for e, c in equWithCount]
+# Get hardcoded cost for per-faction special rules.
+def factionCost(factionRules, unit):
+    return sum([factionRules[r] for r in unit.specialRules + unit.wargearSp if r in factionRules])
+
+
+# Costs of an upgrade for a unit, the key is the upgrade key, the unit key and the cost adjustments.
+# Most upgrades don't change when a faction is rebuilt, so only the edited ones are computed again.
+# The errors printed while computing the costs are kept with them, and printed again on a hit.
+upgrade_cost_cache = LRUCache(65536)
+
+
+numbers = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6}
+
+
+def equipmentsKey(equipments):
+    return tuple(e.Key() for e in equipments)
 
 
 class Upgrade:
     def __init__(self, batch, faction):
         armory = faction.armory
-        self.getFactionCost = faction.getFactionCost
+        self.factionRules = faction.factionRules
         self.all = batch.get('all', False)
         self.text = batch['text']
         self.preremove = armory.get(batch.get('pre-remove', {}))
@@ -72,36 +95,93 @@ class Upgrade:
         self.remove = armory.get(batch.get('remove', {}))
         self.add = [armory.get(up_add) for up_add in batch['add']]
         self.rawcost = []
+        self.key = self._key()
+
+    # the key must be computed again when one of the equipments is redefined
+    def _key(self):
+        return (self.all, equipmentsKey(self.preremove), equipmentsKey(self.preadd), equipmentsKey(self.remove),
+                tuple(equipmentsKey(up_add) for up_add in self.add), tuple(sorted(self.factionRules.items())))
 
     # Calculate the cost of an upgrade on a unit
     # If the upgrade is only for one model, set the unit count to 1
     # remove equipment, add new equipment and calculate the new cost.
     def Cost_unit(self, unit):
+        costs, errors = self.Costs_errors(unit)
+        for equipment, equipments in errors:
+            print(missingEquipment(unit.name, equipment, equipments))
+        return costs
+
+    # Return the costs, and the equipments which were not found as (equipment, current equipments).
+    # The errors are cached with the costs, so they are reported again on a cache hit,
+    # with the name of the unit.
+    def Costs_errors(self, unit):
+        cached = upgrade_cost_cache.get(self._cacheKey(unit))
+        if cached is None:
+            errors = []
+            cached = (self._Cost_unit(unit, errors), errors)
+            upgrade_cost_cache.set(self._cacheKey(unit), cached)
+        return cached
+
+    def _cacheKey(self, unit):
+        return (self.key, unit.Key(), onepagepoints.adjust_defense_cost, onepagepoints.adjust_attack_cost)
+
+    def _Cost_unit(self, unit, errors):
         base_unit = copy.copy(unit)
         if not self.all:
             base_unit.SetCount(1)
 
-        base_unit.RemoveEquipments(self.preremove)
+        base_unit.RemoveEquipments(self.preremove, errors)
         base_unit.AddEquipments(self.preadd)
         base_unit.SetFactionCost(self.getFactionCost(base_unit))
         prev_cost = base_unit.cost
-        base_unit.RemoveEquipments(self.remove)
+        base_unit.RemoveEquipments(self.remove, errors)
+        factionCost = self.getFactionCost(base_unit)
 
         costs = []
         for upgrade in self.add:
-            new_unit = copy.copy(base_unit)
-            new_unit.AddEquipments(upgrade)
-            new_unit.SetFactionCost(self.getFactionCost(new_unit))
-
-            up_cost = new_unit.cost - prev_cost
+            # Most upgrades only add weapons, so only the attack cost changes
+            new_cost = base_unit.CostWithEquipments(upgrade)
+            if new_cost is None:
+                new_unit = copy.copy(base_unit)
+                new_unit.AddEquipments(upgrade)
+                new_unit.SetFactionCost(self.getFactionCost(new_unit))
+                new_cost = new_unit.cost
+            else:
+                new_cost += factionCost
+
+            up_cost = new_cost - prev_cost
             costs.append(up_cost)
 
         # print('Cost for unit {}: {}'.format(unit.name, costs))
         return costs
 
+    def getFactionCost(self, unit):
+        return factionCost(self.factionRules, unit)
+
+    # How many times the options can be taken on a unit of count models, read from the text.
+    # Return (limit for all options of the upgrade, limit for each option):
+    # "up to two" is 2, "any model" or "Replace any" is one per model,
+    # "with any" is each option once, and the others only once.
+    def Limits(self, count):
+        words = self.text.lower().split()
+        if self.all:
+            return (len(self.add), 1) if 'any' in words else (1, 1)
+        n = 1
+        if 'to' in words[:-1] and words[words.index('to') + 1] in numbers:
+            n = numbers[words[words.index('to') + 1]]
+        if 'any' in words:
+            if words[0] == 'replace' or 'model' in words:
+                return count * n, count * n
+            return len(self.add), 1
+        return n, n
+
     # an upgrade group cost is calculated for all units who have access to this
     # upgrade group, so calculate the mean
-    def Cost(self, units):
+    # results are the Costs_errors() of each unit, if they were computed by an executor.
+    def Cost(self, units, results=None):
+        if results is not None:
+            for unit, result in zip(units, results):
+                upgrade_cost_cache.set(self._cacheKey(unit), result)
         u_count = len(units)
         cost = [0] * len(self.add)
         for unit in units:
@@ -121,32 +201,137 @@ class UpgradeGroup(list):
         self.name = ''
 
 
+def read_yaml(filename, path):
+    fname = os.path.join(path, filename)
+    print('  Processing {}'.format(fname))
+    with profiler.phase('yaml read', file=fname):
+        return load_yaml(fname)
+
+
+# Common equipments are shared by all factions, so they can be read only once
+def read_common():
+    if os.path.exists(os.path.join('Common', 'equipments.yml')):
+        return read_yaml('equipments.yml', 'Common')
+    return None
+
+
+# Cost of all upgrades of a group
+def _upgradeGroupCost(group, units):
+    return [upgrade.Cost(units) for upgrade in group]
+
+
+# Costs and errors of the upgrades for each unit, computed by a worker of the executor.
+# The units are snapshots without their upgrades, so the faction is not sent to the worker,
+# and the errors are printed by the faction, in its log.
+def _upgradeCostsErrors(upgrades, units):
+    return [[upgrade.Costs_errors(unit) for unit in units] for upgrade in upgrades]
+
+
+# Costs to compute again after a change.
+# equipments are the names defined in the yaml files, units are unit names,
+# and options are (group index, upgrade index, option index)
+Invalidation = namedtuple('Invalidation', ['equipments', 'units', 'options'])
+
+
+# return the names whose value changed, or None if names were added or removed
+def changedKeys(old, new):
+    if old.keys() != new.keys():
+        return None
+    return {name for name, value in new.items() if old[name] != value}
+
+
+# Reverse index of a faction, from each equipment to the wargear, units and upgrade
+# options which use it, and from each unit to its upgrade groups.
+# Equipments are indexed by the name defined in the yaml files, so "Rifle" also
+# covers "Rifles" and "Linked Rifle". Common equipments are indexed like the others.
+class Dependencies:
+    def __init__(self, faction):
+        self.armory = faction.armory
+        self.wargear = {}
+        self.units = {}
+        self.options = {}
+        self.groups = {}
+        self.optionCounts = [[len(upgrade.add) for upgrade in group] for group in faction.upgrades]
+
+        for name, equipment in self.armory.items():
+            if isinstance(equipment, WarGear):
+                for weapon in equipment.weapons:
+                    self._add(self.wargear, weapon.name, self.armory.base(name))
+
+        for unit in faction.units:
+            for equipment in unit.equipments:
+                self._add(self.units, equipment.name, unit.name)
+
+        for g, group in enumerate(faction.upgrades):
+            for name in group.units:
+                self.groups.setdefault(name, set()).add(g)
+            for u, upgrade in enumerate(group):
+                # a removed equipment changes the cost of all options
+                for equipment in upgrade.preremove + upgrade.preadd + upgrade.remove:
+                    self._add(self.options, equipment.name, (g, u, None))
+                for o, equipments in enumerate(upgrade.add):
+                    for equipment in equipments:
+                        self._add(self.options, equipment.name, (g, u, o))
+
+    def _add(self, index, name, value):
+        index.setdefault(self.armory.base(name), set()).add(value)
+
+    def _allOptions(self, g, u):
+        return {(g, u, o) for o in range(self.optionCounts[g][u])}
+
+    # return the Invalidation for these changed equipments, units, and upgrade groups (by index)
+    def affected(self, equipments=(), units=(), groups=()):
+        names = {self.armory.base(name) for name in equipments}
+        for name in list(names):
+            names |= self.wargear.get(name, set())
+
+        units = set(units)
+        options = set()
+        for name in names:
+            units |= self.units.get(name, set())
+            for g, u, o in self.options.get(name, ()):
+                options |= self._allOptions(g, u) if o is None else {(g, u, o)}
+
+        groups = set(groups)
+        for unit in units:
+            groups |= self.groups.get(unit, set())
+        for g in groups:
+            for u in range(len(self.optionCounts[g])):
+                options |= self._allOptions(g, u)
+        return Invalidation(names, units, options)
+
+
 class Faction():
-    def __init__(self, name):
+    # common is the already parsed Common/equipments.yml, if None it's read from the file
+    # if executor is set, the upgrade costs are computed in parallel with it.
+    def __init__(self, name, common=None, executor=None):
         global armory
         self.name = name
         self.armory = Armory()
         armory = self.armory
         self.pages = []
+        self.common = common
+        self.executor = executor
+        # number of update() done, so the caches built on this faction know when it changed
+        self.updates = 0
         self._parse_yaml()
 
     def _read_yaml(self, filename, path):
-        fname = os.path.join(path, filename)
-        with open(fname, "r") as f:
-            print('  Processing {}'.format(fname))
-            return yaml.load(f.read())
+        return read_yaml(filename, path)
 
     def _parse_yaml(self):
         yfaction = self._read_yaml('faction.yml', self.name)
         self.title = yfaction['title']
 
-        if os.path.exists(os.path.join('Common', 'equipments.yml')):
-            yequipments = self._read_yaml('equipments.yml', 'Common')
-            self.armory.add([Weapon(name, **w) for name, w in yequipments['weapons'].items()])
-
+        ycommon = self.common if self.common is not None else read_common()
         yequipments = self._read_yaml("equipments.yml", self.name)
-        self.armory.add([Weapon(name, **w) for name, w in yequipments['weapons'].items()])
-        self.armory.add([WarGear.from_dict(name, wargear, self.armory) for name, wargear in yequipments['wargear'].items()])
+
+        with profiler.phase('armory build'):
+            if ycommon:
+                self.armory.add([Weapon(name, **w) for name, w in ycommon['weapons'].items()])
+
+            self.armory.add([Weapon(name, **w) for name, w in yequipments['weapons'].items()])
+            self.armory.add([WarGear.from_dict(name, dict(wargear), self.armory) for name, wargear in yequipments['wargear'].items()])
 
         self.factionRules = yequipments['factionRules']
 
@@ -155,21 +340,37 @@ class Faction():
         yunits = self._read_yaml('units.yml', self.name)
         yupgrades = self._read_yaml('upgrades.yml', self.name)
 
-        units = [Unit.from_dict(yunit, self.armory) for yunit in yunits]
-        upgrades = [UpgradeGroup(up_group, self) for up_group in yupgrades]
-
-        for unit in units:
-            unit.SetFactionCost(self.getFactionCost(unit))
-
+        # the yaml files are kept, to find what changed in update()
+        self.yfaction = yfaction
+        self.ycommon = ycommon
+        self.yequipments = yequipments
+        self.yunits = yunits
+        self.yupgrades = yupgrades
+
+        with profiler.phase('unit construction'):
+            units = [Unit.from_dict(dict(yunit), self.armory) for yunit in yunits]
+            upgrades = [UpgradeGroup(up_group, self) for up_group in yupgrades]
+        self.units = units
+        self.upgrades = upgrades
+        self.groups = []
+
+        with profiler.phase('faction cost'):
+            for unit in units:
+                unit.SetFactionCost(self.getFactionCost(unit))
+
+        groups = self.groups
         for g, group in enumerate(upgrades):
             affected_units = [unit for unit in units if unit.name in group.units]
             if len(affected_units) < len(group.units):
                 print('Error units in ugrade group not found {}'.format(group.units))
+                self._costUpgrades(groups)
                 return
             for unit in affected_units:
                 unit.upgrades.append(group)
-            for upgrade in group:
-                upgrade.Cost(affected_units)
+            groups.append((group, affected_units))
+
+        self._costUpgrades(groups)
+        self.dependencies = Dependencies(self)
 
         pages = yfaction.get('pages')
         if len(pages) == 1:
@@ -187,9 +388,158 @@ class Faction():
 
             self.pages.append((punits, pugrades, spRules, psychics))
 
-    # Get hardcoded cost for per-faction special rules.
+    # Each upgrade cost only depends on its units, so they can be computed in any order.
+    # Results from the executor are merged in the group order, so the output is the same.
+    def _costUpgrades(self, groups):
+        with profiler.phase('upgrade costing', groups=len(groups)):
+            self._costUpgradeGroups(groups)
+
+    def _costUpgradeGroups(self, groups):
+        if self.executor is None:
+            for group, affected_units in groups:
+                _upgradeGroupCost(group, affected_units)
+            return
+
+        futures = [self.executor.submit(_upgradeCostsErrors, list(group), [copy.copy(unit) for unit in affected_units])
+                   for group, affected_units in groups]
+        for (group, affected_units), future in zip(groups, futures):
+            for upgrade, results in zip(group, future.result()):
+                upgrade.Cost(affected_units, results)
+
     def getFactionCost(self, unit):
-        return sum([self.factionRules[r] for r in unit.specialRules + unit.wargearSp if r in self.factionRules])
+        return factionCost(self.factionRules, unit)
+
+    # Read the yaml files again, and compute only the costs which changed.
+    # return the Invalidation of what was computed again, or None if the faction must be
+    # built again (pages, factions rules, or names of equipments, units and groups changed)
+    def update(self, common=None):
+        if len(self.groups) != len(self.upgrades):
+            return None
+        yfaction = self._read_yaml('faction.yml', self.name)
+        ycommon = common if common is not None else read_common()
+        yequipments = self._read_yaml('equipments.yml', self.name)
+        yunits = self._read_yaml('units.yml', self.name)
+        yupgrades = self._read_yaml('upgrades.yml', self.name)
+
+        if yfaction != self.yfaction or yequipments['factionRules'] != self.factionRules:
+            return None
+
+        cweapons = (ycommon or {}).get('weapons', {})
+        changed = [changedKeys((self.ycommon or {}).get('weapons', {}), cweapons),
+                   changedKeys(self.yequipments['weapons'], yequipments['weapons']),
+                   changedKeys(self.yequipments['wargear'], yequipments['wargear'])]
+        if None in changed or [u['name'] for u in yunits] != [u['name'] for u in self.yunits]:
+            return None
+        if [g.get('units') for g in yupgrades] != [g.get('units') for g in self.yupgrades]:
+            return None
+        changedCommon, changedWeapons, changedWargear = changed
+
+        # equipments defined twice are only taken from the first definition
+        weapons = [Weapon(name, **cweapons[name]) for name in changedCommon]
+        weapons += [Weapon(name, **yequipments['weapons'][name]) for name in changedWeapons if name not in cweapons]
+        if any((weapon.range > 0) != (self.armory[weapon.name].range > 0) for weapon in weapons):
+            return None
+        changedWargear = [name for name in changedWargear if name not in cweapons and name not in yequipments['weapons']]
+        changedUnits = {new['name'] for old, new in zip(self.yunits, yunits) if old != new}
+        changedGroups = {g for g, (old, new) in enumerate(zip(self.yupgrades, yupgrades)) if old != new}
+
+        invalid = self.dependencies.affected([w.name for w in weapons] + changedWargear, changedUnits)
+
+        for weapon in weapons:
+            self.armory.redefine(weapon)
+        for name in changedWargear:
+            self.armory.redefine(WarGear.from_dict(name, dict(yequipments['wargear'][name]), self.armory))
+
+        # units and groups are updated in place, as they are referenced by the pages
+        for unit, yunit in zip(self.units, yunits):
+            if unit.name in changedUnits:
+                data = dict(yunit)
+                data['equipments'] = self.armory.get(data.pop('equipment'))
+                upgrades = unit.upgrades
+                unit.__init__(**data)
+                unit.upgrades = upgrades
+            elif unit.name in invalid.units:
+                unit.Update()
+            if unit.name in invalid.units:
+                unit.SetFactionCost(self.getFactionCost(unit))
+
+        for g in changedGroups:
+            group = self.upgrades[g]
+            name = group.name
+            group.__init__(yupgrades[g], self)
+            group.name = name
+
+        self.ycommon = ycommon
+        self.yequipments = yequipments
+        self.yunits = yunits
+        self.yupgrades = yupgrades
+        self.dependencies = Dependencies(self)
+        # the upgrades of a modified group may have changed, so use the new index
+        invalid.options.update(self.dependencies.affected(groups=changedGroups).options)
+
+        for g, u in sorted({(g, u) for g, u, o in invalid.options}):
+            upgrade = self.upgrades[g][u]
+            upgrade.key = upgrade._key()
+            upgrade.Cost(self.groups[g][1])
+        self.updates += 1
+        return invalid
+
+
+# Templates are read again only when they are modified (in watch mode),
+# templates is {filename: (mtime, content)}
+templates = {}
+
+
+def template(filename):
+    path = os.path.join('Template', filename)
+    mtime = os.stat(path).st_mtime_ns
+    cached = templates.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = templates[filename] = (mtime, f.read())
+    return cached[1]
+
+
+# Presentation of the faction, computed once and used by all output formats
+# pretty is the equipment string for txt and html, with the count and profile
+EquipmentView = namedtuple('EquipmentView', ['count', 'name', 'profile', 'weapon', 'pretty'])
+UnitView = namedtuple('UnitView', ['name', 'quality', 'defense', 'equipments', 'specialRules', 'upgrades', 'cost'])
+UpgradeView = namedtuple('UpgradeView', ['text', 'options'])
+GroupView = namedtuple('GroupView', ['name', 'upgrades'])
+PageView = namedtuple('PageView', ['units', 'upgrades', 'specialRules', 'psychics'])
+
+
+class FactionView:
+    def __init__(self, faction):
+        self.name = faction.name
+        self.title = faction.title
+        self.profiles = {}
+        self.pages = [PageView([self._unit(unit) for unit in units],
+                               [self._group(group) for group in upgrades],
+                               specialRules, psychics)
+                      for units, upgrades, specialRules, psychics in faction.pages]
+
+    # equipments with their count, in the order of first appearance
+    def equipments(self, equipments):
+        counts = {}
+        for equ in equipments:
+            counts[equ] = counts.get(equ, 0) + 1
+
+        views = []
+        for equ, count in counts.items():
+            profile = self.profiles.get(equ)
+            if profile is None:
+                profile = self.profiles[equ] = equ.Profile()
+            views.append(EquipmentView(count, equ.name, profile, isinstance(equ, Weapon), pCount(count) + equ.name + ' ' + profile))
+        return views
+
+    def _unit(self, unit):
+        return UnitView(prettyName(unit), unit.quality, unit.basedefense, self.equipments(unit.equipments),
+                        unit.specialRules, [group.name for group in unit.upgrades], unit.cost)
+
+    def _group(self, group):
+        upgrades = [UpgradeView(up.text, [(self.equipments(addEqu), up.cost[i]) for i, addEqu in enumerate(up.add)]) for up in group]
+        return GroupView(group.name, upgrades)
 
 
 class DumpTxt:
@@ -197,10 +547,10 @@ class DumpTxt:
         self.data = []
 
     def _addUnit(self, unit):
-        data = ['{0} {1} {2}+'.format(prettyName(unit), str(unit.quality), str(unit.basedefense))]
-        data += [', '.join(PrettyEquipments(unit.equipments))]
+        data = ['{0} {1} {2}+'.format(unit.name, str(unit.quality), str(unit.defense))]
+        data += [', '.join(e.pretty for e in unit.equipments)]
         data += [", ".join(unit.specialRules)]
-        data += [", ".join([group.name for group in unit.upgrades])]
+        data += [", ".join(unit.upgrades)]
         data += [points(unit.cost)]
         return '\n'.join([d for d in data if d])
 
@@ -208,21 +558,20 @@ class DumpTxt:
         self.data += [self._addUnit(unit) for unit in units]
 
     def _getUpLine(self, equ, cost):
-        return ', '.join(PrettyEquipments(equ)) + ' ' + points(cost)
+        return ', '.join(e.pretty for e in equ) + ' ' + points(cost)
 
-    def _getUpGroup(self, group, upgrades):
-        data = ''
-        preamble = group + ' | '
+    def _getUpGroup(self, group):
+        preamble = group.name + ' | '
 
         ret = []
-        for up in upgrades:
+        for up in group.upgrades:
             ret += [preamble + up.text + ':']
-            ret += [self._getUpLine(addEqu, up.cost[i]) for i, addEqu in enumerate(up.add)]
+            ret += [self._getUpLine(equ, cost) for equ, cost in up.options]
             preamble = ''
-        return data + '\n'.join(ret)
+        return '\n'.join(ret)
 
     def addUpgrades(self, upgrades):
-        self.data += [self._getUpGroup(group.name, group) for group in upgrades]
+        self.data += [self._getUpGroup(group) for group in upgrades]
 
     def addPsychics(self, psychics):
         if not psychics:
@@ -230,40 +579,40 @@ class DumpTxt:
         data = [name + '(' + str(power) + '+): ' + desc for power, spell in psychics.items() for name, desc in spell.items()]
         self.data.append('\n'.join(data))
 
-    def get(self, faction):
-        for units, upgrades, specialRules, psychics in faction.pages:
+    def write(self, view, f):
+        for units, upgrades, specialRules, psychics in view.pages:
             self.addUnits(units)
             self.addUpgrades(upgrades)
             self.data.append('\n'.join([k + ': ' + v for k, v in specialRules.items()]))
             self.addPsychics(psychics)
-        return '\n\n'.join(self.data)
+        f.write('\n\n'.join(self.data))
+
+    def get(self, faction):
+        return render(self, faction)
 
 
 class DumpTex:
     def __init__(self):
-        with open('Template/header.tex') as f:
-            self.header = f.read()
+        self.header = template('header.tex')
 
     # Latex uses ~ to prevent line break
     def no_line_break(self, s):
         return s.replace(' ', '~')
 
     def prettyProfile(self, equipment):
-        if isinstance(equipment, Weapon):
-            return self.no_line_break(equipment.Profile())
-        return equipment.Profile()
+        if equipment.weapon:
+            return self.no_line_break(equipment.profile)
+        return equipment.profile
 
     # Return a pretty string for latex of the list of equipments
     def PrettyEquipments(self, equipments):
-        equWithCount = list(OrderedDict.fromkeys([(equ, equipments.count(equ)) for equ in equipments]))
-        return [pCount(c) + self.no_line_break(e.name) + ' ' + self.prettyProfile(e) for e, c in equWithCount]
+        return [pCount(e.count) + self.no_line_break(e.name) + ' ' + self.prettyProfile(e) for e in equipments]
 
     def _addUnit(self, unit):
-        cost = unit.cost
-        equ = ", ".join(['\mbox{' + e + '}' for e in self.PrettyEquipments(unit.equipments)])
+        equ = ", ".join(['\\mbox{' + e + '}' for e in self.PrettyEquipments(unit.equipments)])
         sp = ", ".join(unit.specialRules)
-        up = ", ".join([group.name for group in unit.upgrades])
-        return ' & '.join([prettyName(unit), str(unit.quality), str(unit.basedefense) + '+', equ, sp, up, points(cost)])
+        up = ", ".join(unit.upgrades)
+        return ' & '.join([unit.name, str(unit.quality), str(unit.defense) + '+', equ, sp, up, points(unit.cost)])
 
     def addUnits(self, units):
         self.data.append('\\UnitTable{')
@@ -272,19 +621,19 @@ class DumpTex:
     def _getUpLine(self, equ, cost):
         return ', '.join(self.PrettyEquipments(equ)) + ' & ' + points(cost)
 
-    def _getUpGroup(self, group, upgrades):
+    def _getUpGroup(self, group):
         self.data.append('\\UpgradeTable{')
         data = []
-        preamble = group + ' | '
-        for up in upgrades:
+        preamble = group.name + ' | '
+        for up in group.upgrades:
             data += ['\\multicolumn{2}{p{\\dimexpr \\linewidth - 2pt \\relax}}{\\bf ' + preamble + up.text + ': }']
-            data += [self._getUpLine(addEqu, up.cost[i]) for i, addEqu in enumerate(up.add)]
+            data += [self._getUpLine(equ, cost) for equ, cost in up.options]
             preamble = ''
         self.data.append('\\\\\n'.join(data) + '}')
 
     def addUpgrades(self, upgrades):
         for group in upgrades:
-            self._getUpGroup(group.name, group)
+            self._getUpGroup(group)
 
     def addSpecialRules(self, sp):
         if not sp:
@@ -300,10 +649,10 @@ class DumpTex:
             self.data += ['\\psychic{' + k + '}{' + str(quality) + '+}{' + v + '}' for k, v in spells.items()]
         self.data.append('}')
 
-    def get(self, faction):
-        self.data = ['\\mytitle{' + faction.title + '}']
+    def write(self, view, f):
+        self.data = ['\\mytitle{' + view.title + '}']
         self.data.append('\\begin{document}')
-        for units, upgrades, specialRules, psychics in faction.pages:
+        for units, upgrades, specialRules, psychics in view.pages:
             self.addUnits(units)
             self.data.append('\\begin{multicols*}{3}[]')
             self.addUpgrades(upgrades)
@@ -313,14 +662,17 @@ class DumpTex:
             self.data.append('\\pagebreak')
         self.data.append('\\end{document}')
 
-        return self.header + '\n'.join(self.data)
+        f.write(self.header)
+        f.write('\n'.join(self.data))
+
+    def get(self, faction):
+        return render(self, faction)
 
 
 class HtmlTag:
     def __init__(self, tag, content, tagparm=''):
         self.tag = tag
         self.content = content
-        self.set_indent(0)
         self.leaf = isinstance(content, str)
         if tagparm:
             self.tagparm = ' ' + tagparm
@@ -328,37 +680,36 @@ class HtmlTag:
             self.tagparm = ''
 
     def __str__(self):
-        def get_str(c, indent):
-            if isinstance(c, str):
-                return indent + c
-            return str(c)
-
-        indent = ' ' * self.indent
-        if isinstance(self.content, list):
-            content = '\n'.join(get_str(c, indent) for c in self.content)
-        else:
-            content = self.content
-
+        f = io.StringIO()
+        self.write(f)
+        return f.getvalue()
+
+    # Write the html in one pass, level is the indentation of this tag.
+    # Text content inside a list is indented like its parent tag.
+    def write(self, f, level=0):
+        indent = ' ' * level
         if self.leaf:
-            return '{3}<{0}{1}>{2}</{0}>'.format(self.tag, self.tagparm, content, indent)
-        return '{3}<{0}{1}>\n{2}\n{3}</{0}>'.format(self.tag, self.tagparm, content, indent)
+            f.write('{3}<{0}{1}>{2}</{0}>'.format(self.tag, self.tagparm, self.content, indent))
+            return
 
-    def set_indent(self, level):
-        self.indent = level
-        if isinstance(self.content, HtmlTag):
-            self.content.set_indent(level + 1)
+        f.write('{2}<{0}{1}>\n'.format(self.tag, self.tagparm, indent))
         if isinstance(self.content, list):
-            for c in self.content:
-                if isinstance(c, HtmlTag):
-                    c.set_indent(level + 1)
+            for i, c in enumerate(self.content):
+                if i:
+                    f.write('\n')
+                if isinstance(c, str):
+                    f.write(indent + c)
+                else:
+                    c.write(f, level + 1)
+        else:
+            self.content.write(f, level + 1)
+        f.write('\n{1}</{0}>'.format(self.tag, indent))
 
 
 class DumpHtml:
     def __init__(self):
-        with open('Template/header.html') as f:
-            self.header = f.read()
-        with open('Template/footer.html') as f:
-            self.footer = f.read()
+        self.header = template('header.html')
+        self.footer = template('footer.html')
 
     def no_line_break(self, s):
         return s.replace(' ', '&nbsp;')
@@ -367,10 +718,10 @@ class DumpHtml:
         return self.no_line_break(points(n))
 
     def _addUnit(self, unit):
-        cells = [prettyName(unit), str(unit.quality), str(unit.basedefense) + '+',
-                 ',<br> '.join(PrettyEquipments(unit.equipments)),
+        cells = [unit.name, str(unit.quality), str(unit.defense) + '+',
+                 ',<br> '.join(e.pretty for e in unit.equipments),
                  ", ".join(unit.specialRules),
-                 ", ".join([group.name for group in unit.upgrades]),
+                 ", ".join(unit.upgrades),
                  self.points(unit.cost)]
         return [HtmlTag('td', cell) for cell in cells]
 
@@ -381,20 +732,20 @@ class DumpHtml:
         return HtmlTag('table', rows, 'class=unit')
 
     def _getUpLine(self, equ, cost):
-        cells = [',<br>'.join(PrettyEquipments(equ)), self.points(cost)]
+        cells = [',<br>'.join(e.pretty for e in equ), self.points(cost)]
         return [HtmlTag('td', cell) for cell in cells]
 
-    def _getUpGroup(self, group, upgrades):
-        preamble = group + ' | '
+    def _getUpGroup(self, group):
+        preamble = group.name + ' | '
         rows = []
-        for up in upgrades:
+        for up in group.upgrades:
             rows.append(HtmlTag('tr', [HtmlTag('th', preamble + up.text + ':'), HtmlTag('th', '')]))
-            rows.extend(HtmlTag('tr', self._getUpLine(addEqu, up.cost[i])) for i, addEqu in enumerate(up.add))
+            rows.extend(HtmlTag('tr', self._getUpLine(equ, cost)) for equ, cost in up.options)
             preamble = ''
         return HtmlTag('table', rows, 'class=ut1')
 
     def addUpgrades(self, upgrades):
-        return [HtmlTag('li', self._getUpGroup(group.name, group)) for group in upgrades]
+        return [HtmlTag('li', self._getUpGroup(group)) for group in upgrades]
 
     def addSpecialRules(self, specialRules):
         if not specialRules:
@@ -415,13 +766,29 @@ class DumpHtml:
         lines.append(HtmlTag('li', HtmlTag('table', rows, 'class=psy')))
         return lines
 
-    def get(self, faction):
-        body = [HtmlTag('h1', 'Grimdark Future ' + faction.title)]
-        for units, upgrades, specialRules, psychics in faction.pages:
-            body.append(self.addUnits(units))
+    # Stream the html to a file, only the tags of one page are kept in memory
+    def write(self, view, f):
+        f.write(self.header)
+        f.write('<body>\n')
+        HtmlTag('h1', 'Grimdark Future ' + view.title).write(f, 1)
+        for units, upgrades, specialRules, psychics in view.pages:
+            f.write('\n')
+            self.addUnits(units).write(f, 1)
+            f.write('\n')
             ul = self.addUpgrades(upgrades) + self.addSpecialRules(specialRules) + self.addPsychics(psychics)
-            body.append(HtmlTag('ul', ul))
-        return self.header + str(HtmlTag('body', body)) + self.footer
+            HtmlTag('ul', ul).write(f, 1)
+        f.write('\n</body>')
+        f.write(self.footer)
+
+    def get(self, faction):
+        return render(self, faction)
+
+
+# Render a faction to a string with one of the Dump classes
+def render(dump, faction):
+    f = io.StringIO()
+    dump.write(FactionView(faction), f)
+    return f.getvalue()
 
 
 def gen2(extension):
@@ -434,35 +801,250 @@ def gen2(extension):
     return None
 
 
-def write_file(faction, build_dir, ext):
-    data = gen2(ext).get(faction)
+def output_file(factionName, build_dir, ext):
     path = os.path.join(build_dir, ext)
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-    fname = os.path.join(path, faction.name + '.' + ext)
-    with open(fname, "w") as f:
-        print('  Writing {}'.format(fname))
-        f.write(data)
+    return os.path.join(path, factionName + '.' + ext)
 
 
-def generateFaction(factionName, build_dir='.', outputs=['html']):
+# The presentation of the faction is computed once, and used for all formats
+# return the written files {ext: filename}
+def write_files(faction, build_dir, outputs):
+    with profiler.phase('view'):
+        view = FactionView(faction)
+    files = {}
+    for ext in outputs:
+        fname = output_file(faction.name, build_dir, ext)
+        # rendered directly in the file, so the render and the write are one phase
+        with profiler.phase('write ' + ext):
+            with open(fname, "w") as f:
+                print('  Writing {}'.format(fname))
+                gen2(ext).write(view, f)
+        files[ext] = fname
+    return files
+
+
+# Hash of everything which can change the outputs of a faction:
+# its yaml files, the common equipments, the templates, the python code and the cost parameters
+# The python code is all the modules used to build a faction: points, yaml loading, profiling and output.
+build_modules = [onepagepoints, onepagecache, onepageprofile]
+
+
+def factionKey(factionName, outputs):
+    files = sorted(os.path.join(factionName, f) for f in os.listdir(factionName) if f.endswith('.yml'))
+    files.append(os.path.join('Common', 'equipments.yml'))
+    files += sorted(os.path.join('Template', f) for f in os.listdir('Template'))
+    files += [module.__file__ for module in build_modules] + [__file__]
+    extra = [factionName, onepagepoints.adjust_defense_cost, onepagepoints.adjust_attack_cost] + outputs
+    return hash_inputs(files, extra)
+
+
+# if upgrade_jobs is more than 1, the upgrade costs are computed in a process pool
+# if cache is a BuildCache, the outputs are reused when none of the inputs changed
+def generateFaction(factionName, build_dir='.', outputs=['html'], common=None, upgrade_jobs=1, cache=None):
     factionName = factionName.strip('/')
     print("Building faction " + factionName)
-    faction = Faction(factionName)
-    for ext in outputs:
-        write_file(faction, build_dir, ext)
+    with profiler.phase('faction', faction=factionName):
+        _generateFaction(factionName, build_dir, outputs, common, upgrade_jobs, cache)
+
+
+# Write to several files, to keep a copy of the log while it's printed
+class Tee:
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+
+# The warnings and errors of a cached build are printed again
+def _replayLog(fname):
+    with open(fname) as f:
+        for line in f:
+            if not line.startswith(('  Processing ', '  Writing ')):
+                sys.stdout.write(line)
+
+
+def _generateFaction(factionName, build_dir, outputs, common, upgrade_jobs, cache):
+    if cache:
+        key = factionKey(factionName, outputs)
+        cached = cache.get(key)
+        if cached is not None and all(ext in cached for ext in outputs):
+            print('  Using cached outputs {}'.format(key[:12]))
+            if log_name in cached:
+                _replayLog(cached[log_name])
+            for ext in outputs:
+                fname = output_file(factionName, build_dir, ext)
+                print('  Writing {}'.format(fname))
+                shutil.copyfile(cached[ext], fname)
+            return
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(Tee(sys.stdout, log)) if cache else contextlib.nullcontext():
+        if upgrade_jobs > 1:
+            with ProcessPoolExecutor(upgrade_jobs) as executor:
+                faction = Faction(factionName, common, executor)
+        else:
+            faction = Faction(factionName, common)
+
+        files = write_files(faction, build_dir, outputs)
+
+    if cache:
+        cache.put(key, files, log.getvalue())
+
+
+# Build one faction, and return its log, the error if it failed, and the profile
+# if profiling is enabled (it may run in a worker process)
+def _buildFaction(factionName, build_dir, outputs, common, upgrade_jobs, cache, profile=False):
+    log = io.StringIO()
+    error = None
+    if profile:
+        profiler.enable()
+    with contextlib.redirect_stdout(log):
+        try:
+            generateFaction(factionName, build_dir, outputs, common, upgrade_jobs, cache)
+        except Exception:
+            error = traceback.format_exc()
+    return log.getvalue(), error, profiler.take() if profile else None
+
+
+# Build all factions, with up to "jobs" factions in parallel.
+# The log of each faction is printed in order, a failing faction doesn't stop the others.
+# if profile is a filename, the profile of the builds is printed and written there as a Chrome trace
+# return the list of factions which failed
+def generateFactions(factionNames, build_dir='.', outputs=['html'], jobs=1, upgrade_jobs=1, cache=None, profile=None):
+    if profile:
+        profiler.enable()
+    common = read_common()
+    failed = []
+    # take the events of this process now, so forked workers don't report them again
+    profiles = [profiler.take()] if profile else []
+
+    with contextlib.ExitStack() as stack:
+        if jobs > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(jobs))
+            futures = [executor.submit(_buildFaction, name, build_dir, outputs, common, upgrade_jobs, cache, bool(profile)) for name in factionNames]
+            results = (future.result() for future in futures)
+        else:
+            results = (_buildFaction(name, build_dir, outputs, common, upgrade_jobs, cache, bool(profile)) for name in factionNames)
+
+        for name in factionNames:
+            try:
+                log, error, data = next(results)
+            except Exception:
+                log, error, data = '', traceback.format_exc(), None
+            if data:
+                profiles.append(data)
+            print(log, end='')
+            if error:
+                print('Error building faction {}:\n{}'.format(name, error), file=sys.stderr)
+                failed.append(name)
+
+    if profile:
+        for data in profiles:
+            profiler.merge(data)
+        report(profile)
+        profiler.disable()
+    return failed
+
+
+# Modification time of all yaml files used by a faction
+def factionFiles(factionName):
+    files = [os.path.join(factionName, f) for f in os.listdir(factionName) if f.endswith('.yml')]
+    files.append(os.path.join('Common', 'equipments.yml'))
+    mtimes = {}
+    for fname in files:
+        try:
+            mtimes[fname] = os.stat(fname).st_mtime_ns
+        except OSError:
+            mtimes[fname] = None
+    return mtimes
+
+
+# Update a loaded faction, or build it if it's not loaded or can't be updated.
+# The files are written only if a cost or profile changed.
+def _watchFaction(factions, name, build_dir, outputs, common):
+    start = time.perf_counter()
+    faction = factions.pop(name, None)
+    invalid = faction.update(common) if faction else None
+    if invalid is None:
+        print("Building faction " + name)
+        faction = Faction(name, common)
+    factions[name] = faction
+    if invalid is not None and not invalid.units and not invalid.options:
+        return
+    write_files(faction, build_dir, outputs)
+    duration = (time.perf_counter() - start) * 1000
+    if invalid is None:
+        print('  Built {} in {:.1f} ms'.format(name, duration))
+    else:
+        print('  Updated {}, {} units and {} upgrade options in {:.1f} ms'.format(name, len(invalid.units), len(invalid.options), duration))
+
+
+# Rebuild a faction each time one of its yaml files changes, until interrupted.
+# The factions stay loaded, and only the costs affected by the modified
+# equipments, units and upgrade groups are computed again (see Faction.update).
+def watchFactions(factionNames, build_dir='.', outputs=['html'], interval=0.5):
+    factionNames = [name.strip('/') for name in factionNames]
+    mtimes = {name: None for name in factionNames}
+    factions = {}
+    print('Watching {}, press Ctrl-C to stop'.format(', '.join(factionNames)))
+    try:
+        while True:
+            changed = []
+            for name in factionNames:
+                current = factionFiles(name)
+                if current != mtimes[name]:
+                    mtimes[name] = current
+                    changed.append(name)
+            if changed:
+                common = read_common()
+                for name in changed:
+                    try:
+                        _watchFaction(factions, name, build_dir, outputs, common)
+                    except Exception:
+                        print('Error building faction {}:\n{}'.format(name, traceback.format_exc()), file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
 
 def main():
     parser = argparse.ArgumentParser(description='This script will compute the Unit costs and upgrade costs for a faction, and write the .tex files for LaTeX')
     parser.add_argument('-b', '--build-dir', type=str, default='build',
                         help='directory to write the output files')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of factions to build in parallel')
+    parser.add_argument('--upgrade-jobs', type=int, default=1,
+                        help='number of processes to compute the upgrade costs of one faction')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always rebuild the factions, without using the build cache')
+    parser.add_argument('--cache-dir', type=str, default=default_cache_dir,
+                        help='directory of the build cache')
+    parser.add_argument('--cache-size', type=int, default=default_cache_size // (1024 * 1024),
+                        help='maximum size of the build cache in MB')
+    parser.add_argument('--profile', type=str, metavar='TRACE',
+                        help='print the time of each build phase, and write a Chrome trace to TRACE (json)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, and rebuild a faction each time one of its yaml files changes')
     parser.add_argument('path', type=str, nargs='+',
                         help='path to the faction (should contain at list equipments.yml, units.yml, upgrades.yml)')
 
     args = parser.parse_args()
 
-    for factionName in args.path:
-        generateFaction(factionName, args.build_dir, ['txt', 'html', 'tex'])
+    if args.watch:
+        watchFactions(args.path, args.build_dir, ['txt', 'html', 'tex'])
+        return
+
+    cache = None if args.no_cache else BuildCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    if generateFactions(args.path, args.build_dir, ['txt', 'html', 'tex'], args.jobs, args.upgrade_jobs, cache, args.profile):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
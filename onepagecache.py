@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import sys
+import yaml
+import shutil
+import marshal
+import hashlib
+import tempfile
+
+# libyaml is much faster, but it's not always available
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+"""
+Content addressed cache for the generated files.
+The key is a hash of all the inputs (yaml files, templates, python code),
+so a faction is rebuilt only if something it depends on has really changed.
+"""
+
+default_cache_dir = os.path.join('.cache', 'onepagepoints')
+default_cache_size = 200 * 1024 * 1024
+default_yaml_cache_dir = os.path.join('.cache', 'onepageyaml')
+
+
+# Hash a list of files and extra strings, missing files are hashed as empty
+def hash_inputs(files, extra=[]):
+    h = hashlib.sha256()
+    for fname in files:
+        h.update(fname.encode('utf-8') + b'\0')
+        if os.path.exists(fname):
+            with open(fname, 'rb') as f:
+                h.update(f.read())
+        h.update(b'\0')
+    for e in extra:
+        h.update(str(e).encode('utf-8') + b'\0')
+    return h.hexdigest()
+
+
+# name of the build log in a cache entry
+log_name = 'build.log'
+
+
+class BuildCache:
+    # path is the cache directory, and max_size the maximum size in bytes.
+    # least recently used entries are removed when the cache is too big
+    def __init__(self, path=default_cache_dir, max_size=default_cache_size):
+        self.path = path
+        self.max_size = max_size
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    # return a dict of cached files {name: path}, or None if the key is not in the cache
+    def get(self, key):
+        entry = self._entry(key)
+        try:
+            files = {name: os.path.join(entry, name) for name in os.listdir(entry)}
+            os.utime(entry)
+        except OSError:
+            return None
+        return files
+
+    # store a copy of the files {name: path} for this key, and the build log
+    # the entry is written in a temporary directory first, so concurrent builds
+    # never see an incomplete entry
+    def put(self, key, files, log=None):
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        for name, fname in files.items():
+            shutil.copyfile(fname, os.path.join(tmp, name))
+        if log is not None:
+            with open(os.path.join(tmp, log_name), 'w') as f:
+                f.write(log)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another process stored the same entry
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.trim()
+
+    def _size(self, entry):
+        return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+    # remove the least recently used entries, until the cache fits in max_size
+    def trim(self):
+        entries = []
+        for key in os.listdir(self.path):
+            entry = self._entry(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((os.path.getmtime(entry), self._size(entry), entry))
+            except OSError:
+                continue
+
+        total = sum(size for mtime, size, entry in entries)
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+# Cache of parsed yaml documents, keyed on a hash of the raw data.
+# Documents are stored with marshal, in memory and on disk (if path is not None),
+# each load returns a new copy, so the caller can modify it.
+class YamlCache:
+    def __init__(self, path=default_yaml_cache_dir):
+        self.path = path
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, rawdata):
+        h = hashlib.sha256(rawdata.encode('utf-8'))
+        h.update('{} {} {} {}'.format(yaml.__version__, YamlLoader.__name__, marshal.version, sys.version_info[:2]).encode('utf-8'))
+        return h.hexdigest()
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self.path, key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, key, blob):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, os.path.join(self.path, key))
+        except OSError:
+            pass
+
+    # parse yaml data, or get it from the cache
+    def load(self, rawdata):
+        key = self._key(rawdata)
+        blob = self.memory.get(key)
+        if blob is None and self.path:
+            blob = self._read(key)
+
+        if blob is None:
+            self.misses += 1
+            data = yaml.load(rawdata, Loader=YamlLoader)
+            try:
+                blob = marshal.dumps(data)
+            except ValueError:
+                # not a plain document (dates, ...), don't cache it
+                return data
+            if self.path:
+                self._write(key, blob)
+        else:
+            self.hits += 1
+
+        self.memory[key] = blob
+        return marshal.loads(blob)
+
+    def load_file(self, fname):
+        with open(fname, 'r') as f:
+            return self.load(f.read())
+
+    # forget the documents kept in memory (not the ones on disk)
+    def invalidate(self):
+        self.memory.clear()
+
+
+yaml_cache = YamlCache()
+
+
+def load_yaml(fname):
+    return yaml_cache.load_file(fname)
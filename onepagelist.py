@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import io
+import sys
+import copy
+import json
+import yaml
+import argparse
+import contextlib
+from onepagepoints import LRUCache
+from onepagebatch import Faction, read_common
+from onepagecache import YamlLoader
+
+"""
+Price army lists in bulk, with the published costs (the ones printed in the pdf).
+An army list is a json or yaml object:
+  {"id": "my list", "faction": "Tao", "units": [
+      {"unit": "Fire Warriors", "count": 10, "upgrades": [{"group": "A", "upgrade": 0, "option": 1, "times": 2}]}]}
+count is the number of models (default is the size of the unit in units.yml),
+group is the group letter printed for the unit, or its index in upgrades.yml,
+upgrade and option are the indexes in the group, and in the "add" list.
+times is how many times the option is taken, it can't be more than the text of
+the upgrade allows (Upgrade.Limits).
+Lists are read as json lines or yaml documents, and results are written as json
+lines, as soon as each list is priced.
+"""
+
+
+class ListError(Exception):
+    pass
+
+
+class ListPricer:
+    # factions are loaded the first time they are used
+    def __init__(self):
+        self.factions = {}
+        self.common = None
+        # identical units with the same upgrades are priced only once
+        self.entries = LRUCache(65536)
+
+    def faction(self, name):
+        if name not in self.factions:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if self.common is None:
+                    self.common = read_common()
+                try:
+                    faction = Faction(name, self.common)
+                except OSError:
+                    raise ListError('Unknown faction {}'.format(name))
+            self.factions[name] = (faction, {unit.name: unit for unit in faction.units})
+        return self.factions[name]
+
+    def _group(self, faction, unit, group):
+        if isinstance(group, int):
+            if group not in range(len(faction.upgrades)) or not any(g is faction.upgrades[group] for g in unit.upgrades):
+                raise ListError('Upgrade group {} is not available for {}'.format(group, unit.name))
+            return faction.upgrades[group]
+        for g in unit.upgrades:
+            if g.name == group:
+                return g
+        raise ListError('Upgrade group {} is not available for {}'.format(group, unit.name))
+
+    # Cost of one unit with a model count and its upgrades
+    # The printed cost of an "all" upgrade is for the default size of the unit,
+    # so it's scaled with the model count.
+    def _entryCost(self, faction, unit, count, choices):
+        cost = unit.cost
+        if count != unit.count:
+            sized = copy.copy(unit)
+            sized.SetCount(count)
+            sized.SetFactionCost(faction.getFactionCost(sized))
+            cost = sized.cost
+        taken = {}
+        for group, u, o, times in choices:
+            upgrades = self._group(faction, unit, group)
+            # 1.0 in range(2) is True, but it's not an index
+            if not isinstance(u, int) or not isinstance(o, int):
+                raise ListError('Unknown upgrade {} {} {} for {}'.format(group, u, o, unit.name))
+            if u not in range(len(upgrades)) or o not in range(len(upgrades[u].cost)):
+                raise ListError('Unknown upgrade {} {} {} for {}'.format(group, u, o, unit.name))
+            if not isinstance(times, int) or times < 1:
+                raise ListError('Bad number of upgrades {} for {}'.format(times, unit.name))
+            upgrade = upgrades[u]
+            taken[upgrade] = taken.get(upgrade, 0) + times
+            taken[(upgrade, o)] = taken.get((upgrade, o), 0) + times
+            total, each = upgrade.Limits(count)
+            if taken[upgrade] > total or taken[(upgrade, o)] > each:
+                raise ListError('Too many upgrades "{}" for {}'.format(upgrade.text, unit.name))
+            if upgrade.all:
+                cost += int(round(upgrade.cost[o] * count / unit.count)) * times
+            else:
+                cost += upgrade.cost[o] * times
+        return cost
+
+    def entryCost(self, factionName, entry):
+        faction, units = self.faction(factionName)
+        unit = units.get(entry.get('unit'))
+        if unit is None:
+            raise ListError('Unknown unit {}'.format(entry.get('unit')))
+        count = entry.get('count', unit.count)
+        if not isinstance(count, int) or count < 1:
+            raise ListError('Bad model count {} for {}'.format(count, unit.name))
+        try:
+            choices = tuple(sorted(((up.get('group'), up.get('upgrade', 0), up.get('option'), up.get('times', 1))
+                                    for up in entry.get('upgrades', [])), key=repr))
+            key = (factionName, unit.name, count, choices)
+            cost = self.entries.get(key)
+        except (AttributeError, TypeError):
+            raise ListError('Bad upgrades {} for {}'.format(entry.get('upgrades'), unit.name))
+        if cost is None:
+            cost = self._entryCost(faction, unit, count, choices)
+            self.entries.set(key, cost)
+        return cost
+
+    # Price one army list, errors are reported in the result, so one bad list doesn't stop the others
+    def price(self, armylist):
+        result = {'id': armylist.get('id'), 'faction': armylist.get('faction'), 'cost': 0, 'units': []}
+        errors = []
+        try:
+            if not isinstance(armylist.get('faction'), str):
+                raise ListError('Missing faction')
+            self.faction(armylist['faction'])
+        except ListError as e:
+            result['errors'] = [str(e)]
+            return result
+        units = armylist.get('units', [])
+        if not isinstance(units, list):
+            result['errors'] = ['Units should be a list, not {}'.format(units)]
+            return result
+        for entry in units:
+            try:
+                if not isinstance(entry, dict):
+                    raise ListError('A unit should be an object, not {}'.format(entry))
+                cost = self.entryCost(armylist.get('faction'), entry)
+            except ListError as e:
+                errors.append(str(e))
+                continue
+            result['units'].append({'unit': entry.get('unit'), 'cost': cost})
+            result['cost'] += cost
+        if errors:
+            result['errors'] = errors
+        return result
+
+    def priceAll(self, armylists):
+        for armylist in armylists:
+            # readLists yields the error instead of a list it can't parse
+            if isinstance(armylist, ListError):
+                yield {'errors': [str(armylist)]}
+                continue
+            if not isinstance(armylist, dict):
+                yield {'errors': ['An army list should be an object']}
+                continue
+            yield self.price(armylist)
+
+
+# Read army lists one by one from a file, as json lines or yaml documents.
+# A json file starting with "[" is read as one array.
+# A json line which can't be parsed gives a ListError, and the next lines are still read.
+def readLists(f, fmt):
+    if fmt == 'yaml':
+        try:
+            yield from yaml.load_all(f, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            yield ListError('Bad yaml: {}'.format(e))
+        return
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+    if first == '[':
+        try:
+            armylists = json.loads(first + f.read())
+        except ValueError as e:
+            yield ListError('Bad json: {}'.format(e))
+            return
+        yield from armylists
+        return
+    line = first + f.readline()
+    n = 1
+    while line:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ListError('Bad json on line {}: {}'.format(n, e))
+        line = f.readline()
+        n += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Price army lists, with the costs printed for each faction')
+    parser.add_argument('-f', '--format', choices=['json', 'yaml'],
+                        help='format of the army lists, default is from the file extension, or json for stdin')
+    parser.add_argument('-o', '--output', type=str,
+                        help='write the results in this file instead of stdout')
+    parser.add_argument('lists', type=str, nargs='*',
+                        help='files with army lists, default is stdin')
+
+    args = parser.parse_args()
+
+    pricer = ListPricer()
+    out = open(args.output, 'w') if args.output else sys.stdout
+    with out:
+        for fname in args.lists or ['-']:
+            fmt = args.format or ('yaml' if fname.endswith(('.yml', '.yaml')) else 'json')
+            with (open(fname) if fname != '-' else contextlib.nullcontext(sys.stdin)) as f:
+                for result in pricer.priceAll(readLists(f, fmt)):
+                    out.write(json.dumps(result) + '\n')
+                    out.flush()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
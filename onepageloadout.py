@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import io
+import sys
+import copy
+import argparse
+import contextlib
+from onepagepoints import LRUCache
+from onepagebatch import Faction, points, pCount
+
+"""
+Exact cost of a unit with any combination of upgrade options.
+The printed cost of an option is a mean over all units of the group, measured
+alone, so combined options can be mispriced (a wargear giving a better quality
+also makes the other weapons more expensive). Here all the chosen options are
+applied to the unit, and its cost is computed again.
+An option of an upgrade with "all" is applied to all models. Other options are
+applied to one model: a model which has no option yet if it has the equipments
+to replace, else the first model with options which has them. The cost is the
+cost of the unit with the "all" options, plus for each model with options, the
+difference between this model and one model with only the "all" options.
+A choice is (group, upgrade, option), with the indexes in upgrades.yml, and is
+repeated to take the option several times (Upgrade.Limits gives how many).
+"""
+
+
+class IllegalLoadout(Exception):
+    pass
+
+
+# Same check as Unit.RemoveEquipment, without modifying the unit
+# Removing a plural name only looks at the first equipment.
+def canRemove(equipments, removed):
+    equipments = list(equipments)
+    for e in removed:
+        if e in equipments:
+            equipments.remove(e)
+        elif e.name.endswith('s') and equipments and equipments[0].name == e.name[:-1]:
+            equipments.pop(0)
+        else:
+            return False
+    return True
+
+
+# The units of a loadout: the whole unit with the "all" options, one model
+# with the "all" options, and the models which have other options
+class LoadoutState:
+    __slots__ = ('unit', 'modelBase', 'models')
+
+    def __init__(self, unit, modelBase, models):
+        self.unit = unit
+        self.modelBase = modelBase
+        self.models = models
+
+    # attr can also be defenseCost, attackCost or otherCost, to get a part of the cost
+    def Cost(self, attr='cost'):
+        base = getattr(self.modelBase, attr)
+        return getattr(self.unit, attr) + sum(getattr(model, attr) - base for model in self.models)
+
+
+class LoadoutPricer:
+    # states are memoized by unit and choices, so a loadout is computed from
+    # the state of the same loadout with one option less
+    # The unit is identified by its Key(), so a resized unit doesn't get the
+    # states of the original one, and the states are dropped when the faction is updated.
+    def __init__(self, faction, maxStates=65536):
+        self.faction = faction
+        self.states = LRUCache(maxStates)
+        self.updates = faction.updates
+
+    def _sync(self):
+        if self.updates != self.faction.updates:
+            self.states.invalidate()
+            self.updates = self.faction.updates
+
+    # return the (group, upgrade) indexes available for the unit
+    def upgrades(self, unit):
+        return [(g, u) for g, group in enumerate(self.faction.upgrades) if any(group is ug for ug in unit.upgrades)
+                for u in range(len(group))]
+
+    def _apply(self, unit, upgrade, o):
+        new = copy.copy(unit)
+        new.RemoveEquipments(upgrade.remove)
+        new.AddEquipments(upgrade.add[o])
+        new.SetFactionCost(self.faction.getFactionCost(new))
+        return new
+
+    def _initial(self, unit):
+        whole = copy.copy(unit)
+        whole.SetFactionCost(self.faction.getFactionCost(whole))
+        model = copy.copy(unit)
+        model.SetCount(1)
+        model.SetFactionCost(self.faction.getFactionCost(model))
+        return LoadoutState(whole, model, ())
+
+    # choices must be sorted, and be legal for Upgrade.Limits
+    # unitKey is unit.Key(), given by the callers which already computed it
+    def _state(self, unit, choices, unitKey=None):
+        if unitKey is None:
+            unitKey = unit.Key()
+        key = (unitKey, choices)
+        state = self.states.get(key)
+        if state is not None:
+            return state
+
+        if not choices:
+            state = self._initial(unit)
+        else:
+            prev = self._state(unit, choices[:-1], unitKey)
+            g, u, o = choices[-1]
+            upgrade = self.faction.upgrades[g][u]
+            removed = [e.name for e in upgrade.remove]
+            if upgrade.all:
+                if not all(canRemove(model.equipments, upgrade.remove) for model in (prev.unit, prev.modelBase) + prev.models):
+                    raise IllegalLoadout('{} can not be removed'.format(removed))
+                state = LoadoutState(self._apply(prev.unit, upgrade, o), self._apply(prev.modelBase, upgrade, o),
+                                     tuple(self._apply(model, upgrade, o) for model in prev.models))
+            elif len(prev.models) < unit.count and canRemove(prev.modelBase.equipments, upgrade.remove):
+                state = LoadoutState(prev.unit, prev.modelBase, prev.models + (self._apply(prev.modelBase, upgrade, o),))
+            else:
+                m = next((m for m, model in enumerate(prev.models) if canRemove(model.equipments, upgrade.remove)), None)
+                if m is None:
+                    raise IllegalLoadout('{} can not be removed'.format(removed))
+                models = prev.models[:m] + (self._apply(prev.models[m], upgrade, o),) + prev.models[m + 1:]
+                state = LoadoutState(prev.unit, prev.modelBase, models)
+        self.states.set(key, state)
+        return state
+
+    # Each option can be taken up to its limit, and all the options of an upgrade
+    # up to the limit of the upgrade
+    def _legal(self, unit, choices):
+        taken = {}
+        for g, u, o in choices:
+            taken[(g, u)] = taken.get((g, u), 0) + 1
+            taken[(g, u, o)] = taken.get((g, u, o), 0) + 1
+        for g, u, o in set(choices):
+            total, each = self.faction.upgrades[g][u].Limits(unit.count)
+            if taken[(g, u)] > total or taken[(g, u, o)] > each:
+                return False
+        return True
+
+    def _check(self, unit, choices):
+        available = set(self.upgrades(unit))
+        for choice in choices:
+            if len(choice) != 3 or not all(isinstance(i, int) for i in choice):
+                raise IllegalLoadout('A choice should be (group, upgrade, option), not {}'.format(choice))
+            g, u, o = choice
+            if (g, u) not in available:
+                raise IllegalLoadout('Upgrade {} {} is not available for {}'.format(g, u, unit.name))
+            if o not in range(len(self.faction.upgrades[g][u].add)):
+                raise IllegalLoadout('Unknown option {} {} {}'.format(g, u, o))
+        if not self._legal(unit, choices):
+            raise IllegalLoadout('Too many options {} for {}'.format(list(choices), unit.name))
+
+    # State of the unit with these choices, raise IllegalLoadout if an upgrade
+    # is not available, is taken too many times, or removes an equipment no model has
+    def state(self, unit, choices):
+        choices = tuple(sorted(tuple(choice) for choice in choices))
+        self._check(unit, choices)
+        self._sync()
+        return self._state(unit, choices)
+
+    # Exact cost of the unit with these choices
+    def price(self, unit, choices):
+        return self.state(unit, choices).Cost()
+
+    # Yield all legal loadouts of the unit (choices, cost), with at most
+    # maxOptions options in total
+    def loadouts(self, unit, maxOptions=None):
+        options = [(g, u, o) for g, u in self.upgrades(unit) for o in range(len(self.faction.upgrades[g][u].add))]
+        unitKey = unit.Key()
+        self._sync()
+
+        def explore(i, choices):
+            yield choices, self._state(unit, choices, unitKey).Cost()
+            if maxOptions is not None and len(choices) >= maxOptions:
+                return
+            # an option can be taken again, so the next one starts at k
+            for k in range(i, len(options)):
+                new = choices + (options[k],)
+                if not self._legal(unit, new):
+                    continue
+                try:
+                    self._state(unit, new, unitKey)
+                except IllegalLoadout:
+                    continue
+                yield from explore(k, new)
+
+        yield from explore(0, ())
+
+
+# Names of the chosen options, like "Fusion Carbine, 2x Gun Drone + Shield"
+# an option taken several times is written like "2x (Shard Cannon)"
+def describe(faction, choices):
+    def option(equipments):
+        counts = {}
+        for e in equipments:
+            counts[e.name] = counts.get(e.name, 0) + 1
+        return ' + '.join(pCount(count) + name for name, count in counts.items())
+
+    taken = {}
+    for choice in choices:
+        taken[choice] = taken.get(choice, 0) + 1
+    names = []
+    for (g, u, o), n in taken.items():
+        name = option(faction.upgrades[g][u].add[o])
+        names.append(name if n == 1 else '{}({})'.format(pCount(n), name))
+    return ', '.join(names) or 'base'
+
+
+# argparse type of a choice, "group,upgrade,option"
+def choiceArg(text):
+    try:
+        choice = tuple(int(i) for i in text.split(','))
+    except ValueError:
+        choice = ()
+    if len(choice) != 3:
+        raise argparse.ArgumentTypeError('{} should be group,upgrade,option'.format(text))
+    return choice
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exact cost of a unit with a combination of upgrade options')
+    parser.add_argument('faction', type=str,
+                        help='path to the faction')
+    parser.add_argument('unit', type=str,
+                        help='name of the unit')
+    parser.add_argument('choices', type=choiceArg, nargs='*',
+                        help='options as group,upgrade,option (indexes in upgrades.yml), all legal loadouts are listed if none')
+    parser.add_argument('-m', '--max-options', type=int,
+                        help='maximum number of options of the listed loadouts')
+
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        faction = Faction(args.faction.strip('/'))
+    units = [unit for unit in faction.units if unit.name == args.unit]
+    if not units:
+        print('Error unit {} not found'.format(args.unit))
+        sys.exit(1)
+    pricer = LoadoutPricer(faction)
+
+    if args.choices:
+        try:
+            cost = pricer.price(units[0], args.choices)
+        except IllegalLoadout as e:
+            print('Error {}'.format(e))
+            sys.exit(1)
+        print('{}: {}'.format(describe(faction, sorted(args.choices)), points(cost)))
+        return
+
+    for choices, cost in pricer.loadouts(units[0], args.max_options):
+        print('{}: {}'.format(describe(faction, choices), points(cost)))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
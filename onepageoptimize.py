@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import io
+import argparse
+import contextlib
+from collections import namedtuple
+from onepagebatch import Faction, points
+from onepageloadout import LoadoutPricer, describe
+
+"""
+Find the army lists which get the most value for a points budget.
+The price of a unit is its printed cost plus the printed cost of its options,
+and its value is the exact cost computed for its loadout (or only its attack,
+defense or other cost). A list with much more value than its price shows
+under-costed units or options.
+Each unit can be taken up to max-copies times, each copy with its own loadout.
+This is a multiple choice knapsack, solved by dynamic programming on the
+Pareto front (price, value) of the partial lists, for each number of units and
+heroes when they are limited.
+"""
+
+metrics = {'cost': 'cost', 'attack': 'attackCost', 'defense': 'defenseCost', 'other': 'otherCost'}
+
+# One unit with a loadout
+Option = namedtuple('Option', ['price', 'value', 'unit', 'choices'])
+
+# Partial list, chosen is a linked list (option, previous chosen) to avoid copies
+State = namedtuple('State', ['price', 'value', 'chosen'])
+
+
+# Keep only the options which are not more expensive and less valuable than another one
+def paretoFront(items):
+    front = []
+    for item in sorted(items, key=lambda i: (i.price, -i.value)):
+        if not front or item.value > front[-1].value:
+            front.append(item)
+    return front
+
+
+class ArmyOptimizer:
+    def __init__(self, faction, metric='cost', maxOptions=2, maxCopies=3, maxUnits=None, maxHeroes=None):
+        self.faction = faction
+        self.attr = metrics[metric]
+        self.maxOptions = maxOptions
+        self.maxCopies = maxCopies
+        self.maxUnits = maxUnits
+        self.maxHeroes = maxHeroes
+        self.pricer = LoadoutPricer(faction)
+
+    # price is the printed cost of the unit and its options
+    def price(self, unit, choices):
+        return unit.cost + sum(self.faction.upgrades[g][u].cost[o] for g, u, o in choices)
+
+    # All loadouts of a unit, without the dominated ones
+    def unitOptions(self, unit):
+        options = []
+        for choices, cost in self.pricer.loadouts(unit, self.maxOptions):
+            value = self.pricer.state(unit, choices).Cost(self.attr)
+            options.append(Option(self.price(unit, choices), value, unit, choices))
+        return paretoFront(options)
+
+    # the states are grouped by (number of units, number of heroes), only when they are limited
+    def _key(self, key, unit):
+        units, heroes = key
+        if self.maxUnits is not None:
+            units += 1
+            if units > self.maxUnits:
+                return None
+        if self.maxHeroes is not None and 'Hero' in unit.specialRules:
+            heroes += 1
+            if heroes > self.maxHeroes:
+                return None
+        return units, heroes
+
+    # return the best list for this budget, as (value, price, [Option])
+    # A partial list is dropped if even with the best value per point of the
+    # remaining units, it can't reach the value of the best list found so far.
+    def solve(self, budget):
+        def ratio(options):
+            return max([option.value / option.price if option.price else float('inf') for option in options] + [0])
+
+        # the best units first, so good lists are found early
+        units = [(unit, [option for option in self.unitOptions(unit) if option.price <= budget]) for unit in self.faction.units]
+        units.sort(key=lambda u: -ratio(u[1]))
+        ratios = [ratio(options) for unit, options in units]
+
+        fronts = {(0, 0): [State(0, 0, None)]}
+        for i, (unit, options) in enumerate(units):
+            for k in range(self.maxCopies):
+                # a free option has no bound on its value, so nothing can be dropped
+                if ratios[i] != float('inf'):
+                    lower = max(state.value for front in fronts.values() for state in front)
+                    fronts = {key: [state for state in front if state.value + ratios[i] * (budget - state.price) >= lower]
+                              for key, front in fronts.items()}
+                new = {key: list(front) for key, front in fronts.items()}
+                for key, front in fronts.items():
+                    newKey = self._key(key, unit)
+                    if newKey is None:
+                        continue
+                    target = new.setdefault(newKey, [])
+                    for state in front:
+                        for option in options:
+                            price = state.price + option.price
+                            if price > budget:
+                                break
+                            target.append(State(price, state.value + option.value, (option, state.chosen)))
+                fronts = {key: paretoFront(front) for key, front in new.items()}
+
+        best = max((state for front in fronts.values() for state in front), key=lambda s: (s.value, -s.price))
+        chosen = []
+        node = best.chosen
+        while node:
+            chosen.append(node[0])
+            node = node[1]
+        order = {unit.name: i for i, unit in enumerate(self.faction.units)}
+        return best.value, best.price, sorted(chosen, key=lambda option: order[option.unit.name])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the army list with the most value for a points budget, to find under-costed units and options')
+    parser.add_argument('faction', type=str,
+                        help='path to the faction')
+    parser.add_argument('budget', type=int,
+                        help='maximum points of the list')
+    parser.add_argument('--metric', choices=sorted(metrics), default='cost',
+                        help='value of a unit, its exact cost or only a part of it')
+    parser.add_argument('-o', '--max-options', type=int, default=2,
+                        help='maximum number of options for each unit')
+    parser.add_argument('-c', '--max-copies', type=int, default=3,
+                        help='maximum number of times a unit can be taken')
+    parser.add_argument('-u', '--max-units', type=int,
+                        help='maximum number of units in the list')
+    parser.add_argument('--max-heroes', type=int,
+                        help='maximum number of heroes in the list')
+
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        faction = Faction(args.faction.strip('/'))
+    optimizer = ArmyOptimizer(faction, args.metric, args.max_options, args.max_copies, args.max_units, args.max_heroes)
+    value, price, chosen = optimizer.solve(args.budget)
+
+    for option in chosen:
+        print('{} ({}): {} for {} value'.format(option.unit.name, describe(faction, option.choices), points(option.price), option.value))
+    print('Total: {} for {} value ({:+.1f}%)'.format(points(price), value, (value - price) * 100 / price if price else 0))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
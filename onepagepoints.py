@@ -22,6 +22,7 @@ CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 import copy
+from collections import OrderedDict, namedtuple
 
 # Adjust defense and attack cost, to match onepagerules current prices
 adjust_defense_cost = 0.7
@@ -80,9 +81,111 @@ def dice_mean(value):
     return mean + int(add)
 
 
+# Bounded LRU cache, used for the weapon and upgrade costs, the parsed unit rules,
+# and the loadouts and army list entries. None can't be stored, as get() returns
+# None for a missing key.
+class LRUCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    # return the cached value, or None if it's not in the cache
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self):
+        self.data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+
+# Weapon costs, the key is the weapon profile, speed and quality.
+# The cached costs depends on adjust_attack_cost, so invalidate() must be called
+# when it is changed.
+weapon_cost_cache = LRUCache()
+
+
+# Weapon profile, with the special rules already applied, so the cost is only arithmetic.
+# quality is the quality forced by the weapon (Autohit, Sniper) or None,
+# qualityDelta is added after that (Linked, Flux).
+# rending is the cost added by the Rending rule.
+WeaponModifiers = namedtuple('WeaponModifiers', ['range', 'attacks', 'ap', 'factor', 'impact', 'rending', 'quality', 'qualityDelta'])
+
+
+# Parse the weapon special rules once, return the modifiers and the list of rules
+# which have no effect on the cost.
+def compile_weapon_rules(wrange, attacks, ap, rules):
+    sfactor = 1
+    simpact = 0
+    rending = 0
+    quality = None
+    qdelta = 0
+    unknown = []
+    ap = dice_mean(ap)
+    attacks = dice_mean(attacks)
+
+    for s in rules:
+        if s == 'Deadly':
+            sfactor *= 2.5
+        elif s == 'Linked':
+            qdelta -= 1
+        elif s == 'Rending':
+            # rending is 1/6 of having AP(8)
+            rending = (1 / 6) * (ap_cost(8) - ap_cost(ap))
+        elif s == 'Flux':
+            # Flux is statistically like having quality +2
+            qdelta -= 2
+        elif s.startswith('Poison('):
+            ap += int(s[7:-1]) / 2
+        elif s.startswith('Blast('):
+            sfactor *= int(s[6:-1])
+        elif s.startswith('Impact('):
+            simpact = int(s[7:-1])
+        elif s == 'Autohit':
+            quality = 1
+            qdelta = 0
+        elif s == 'Limited':
+            sfactor /= 2
+        elif s == 'Secondary':
+            sfactor /= 4
+        elif s == 'Sniper':
+            # Sniper is 2+ hit and ignore cover (so statistically half an ap)
+            quality = 2
+            qdelta = 0
+            ap += 0.5
+        elif s == 'Indirect':
+            wrange *= 1.4
+        elif s == 'Anti-Air':
+            sfactor *= 1.10
+        else:
+            unknown.append(s)
+
+    return WeaponModifiers(wrange, attacks, ap, sfactor, simpact, rending, quality, qdelta), unknown
+
+
 # WargGear can include special rules for model, and weapons
 # Like a jetbike gives "fast" rules and a Linked ShardGun
 class WarGear:
+    __slots__ = ('name', 'specialRules', 'weapons', 'text')
+
     def __init__(self, name='Unknown Gear', special=[], weapons=[], text=''):
         self.name = name
         self.specialRules = special
@@ -103,6 +206,10 @@ class WarGear:
     def __str__(self):
         s = self.name + ' ' + self.Profile()
 
+    # Everything the cost of a unit with this wargear depends on
+    def Key(self):
+        return (self.name, tuple(self.specialRules), tuple(w.Key() for w in self.weapons))
+
     def Cost(self, speed, quality):
         cost = 0
         for w in self.weapons:
@@ -112,6 +219,9 @@ class WarGear:
 
 # Class for weapons
 class Weapon:
+    __slots__ = ('name', 'range', 'attacks', 'armorPiercing', 'weaponRules', 'specialRules', 'cost',
+                 'modifiers', 'unknownRules')
+
     def __init__(self, name='Unknown Weapon', range=0, attacks=0, ap=0, special=[]):
         self.name = name
         self.range = range
@@ -120,9 +230,10 @@ class Weapon:
         self.weaponRules = special
         self.specialRules = []
         self.cost = 0
+        self.modifiers, self.unknownRules = compile_weapon_rules(range, attacks, ap, special)
 
     def __repr__(self):
-        return "{0}({1})".format(self.name, self.__dict__)
+        return "{0}({1})".format(self.name, {k: getattr(self, k) for k in self.__slots__})
 
     def Profile(self):
         def fmtnz(value, fmt):
@@ -146,93 +257,123 @@ class Weapon:
         s += self.__str__()
         return s
 
+    # The name is needed as equipments are removed by name
+    def Key(self):
+        return (self.name, self.modifiers)
+
+    # Weapon cost only depends on its modifiers, so it's cached for each speed/quality
     def Cost(self, speed, quality):
-        sfactor = 1
-        simpact = 0
-        rending = 0
-        wrange = self.range
-        ap = dice_mean(self.armorPiercing)
-        attacks = dice_mean(self.attacks)
-
-        for s in self.weaponRules:
-            if s == 'Deadly':
-                sfactor *= 2.5
-            elif s == 'Linked':
-                quality -= 1
-            elif s == 'Rending':
-                # rending is 1/6 of having AP(8)
-                rending = (1 / 6) * (ap_cost(8) - ap_cost(ap))
-            elif s == 'Flux':
-                # Flux is statistically like having quality +2
-                quality -= 2
-            elif s.startswith('Poison'):
-                ap += int(s[7:-1]) / 2
-            elif s.startswith('Blast'):
-                sfactor *= int(s[6:-1])
-            elif s.startswith('Impact'):
-                simpact = int(s[7:-1])
-            elif s == 'Autohit':
-                quality = 1
-            elif s == 'Limited':
-                sfactor /= 2
-            elif s == 'Secondary':
-                sfactor /= 4
-            elif s == 'Sniper':
-                # Sniper is 2+ hit and ignore cover (so statistically half an ap)
-                quality = 2
-                ap += 0.5
-            elif s == 'Indirect':
-                wrange *= 1.4
-            elif s == 'Anti-Air':
-                sfactor *= 1.10
-
-        self.cost = sfactor * attacks * range_cost(wrange, speed) * (ap_cost(ap) * quality_attack_factor(quality) + rending)
+        key = (self.modifiers, speed, quality)
+        cost = weapon_cost_cache.get(key)
+        if cost is None:
+            cost = self._Cost(speed, quality)
+            weapon_cost_cache.set(key, cost)
+        self.cost = cost
+        return cost
+
+    def _Cost(self, speed, quality):
+        m = self.modifiers
+        if m.quality is not None:
+            quality = m.quality
+        quality += m.qualityDelta
+        rcost = range_cost(m.range, speed)
+        apcost = ap_cost(m.ap)
+
+        cost = m.factor * m.attacks * rcost * (apcost * quality_attack_factor(quality) + m.rending)
         # Impact weapon have automatic hit, but only when charging (so 0.5 cost of the same weapon without quality factor)
-        if simpact:
-            self.cost += 0.5 * simpact * sfactor * ap_cost(ap) * range_cost(wrange, speed)
+        if m.impact:
+            cost += 0.5 * m.impact * m.factor * apcost * rcost
 
-        self.cost = int(round(self.cost * adjust_attack_cost))
-        return self.cost
+        return int(round(cost * adjust_attack_cost))
 
 
 class Armory(dict):
+    # Weapon rules without cost, already reported.
+    reportedRules = set()
+
     # Armory class is a dictionnary of all Weapons and WarGear for a faction.
+    # resolved is the index of all names already looked up, with their equipments
+    # linkable are the weapons which can have a "Linked" variant
+    # variants are the equipments created from another one {name: (parent name, linked)}
     def __init__(self, *args):
         dict.__init__(self, args)
+        self.resolved = {}
+        self.linkable = {}
+        self.variants = {}
 
-    # get one equipment from the armory.
-    def getOne(self, name):
+    def _linked(self, name, weapon):
+        return Weapon(name, weapon.range, weapon.attacks, weapon.armorPiercing, ['Linked'] + weapon.weaponRules)
+
+    def _plural(self, name, equipment):
+        plural = copy.copy(equipment)
+        plural.name = name
+        return plural
+
+    # get an equipment, the "Linked" variant of a weapon is created the first time it's used
+    def _find(self, name):
         if name in self:
             return self[name]
 
+        if name.startswith('Linked '):
+            weapon = self.linkable.get(name[7:])
+            if weapon is not None:
+                self[name] = self._linked(name, weapon)
+                self.variants[name] = (weapon.name, True)
+                return self[name]
+        return None
+
+    # get one equipment from the armory.
+    # plural names are created from the singular equipment, and kept in the armory
+    def getOne(self, name):
+        equipment = self._find(name)
+        if equipment is not None:
+            return equipment
+
         if name.endswith('s'):
-            singular = name[:-1]
-            if singular in self:
-                self[name] = copy.copy(self[singular])
-                self[name].name = name
+            singular = self._find(name[:-1])
+            if singular is not None:
+                self[name] = self._plural(name, singular)
+                self.variants[name] = (singular.name, False)
                 return self[name]
 
         print('Error equipment {0} Not found !'.format(name))
         return None
 
+    # Return the equipments for one name, as a tuple.
+    # "2x Foo" gives twice the same object, plural names gives the singular equipment
+    def resolve(self, spelling):
+        equipments = self.resolved.get(spelling)
+        if equipments is not None:
+            return equipments
+
+        n, name = 1, spelling
+        if ' ' in spelling:
+            firstword, remaining = spelling.split(' ', 1)
+            if firstword.endswith('x') and firstword[:-1].isdigit():
+                n, name = int(firstword[:-1]), remaining
+
+        equipment = self.getOne(name)
+        equipments = (equipment,) * n
+        # don't keep unknown names, so the error is printed each time
+        if equipment is not None:
+            self.resolved[spelling] = equipments
+        return equipments
+
     # Return the list of equipments objects, from their names.
     # if the name start with "2x ", return twice the same object in the list.
     def get(self, names):
-        for name in names:
-            if ' ' in name:
-                firstword, remaining = name.split(' ', 1)
-                if firstword.endswith('x') and firstword[:-1].isdigit():
-                    n = int(firstword[:-1])
-                    position = names.index(name)
-                    names.remove(name)
-                    for i in range(n):
-                        names.insert(position, remaining)
-
-        return [self.getOne(name) for name in names]
+        return [equipment for name in names for equipment in self.resolve(name)]
+
+    def _report(self, weapon):
+        for rule in weapon.unknownRules:
+            if rule not in self.reportedRules:
+                print('Warning weapon rule {} has no effect on the cost'.format(rule))
+                self.reportedRules.add(rule)
 
     # Add an equipments to the armory
-    # if it's a weapon, also add the Linked variant
+    # if it's a ranged weapon, its Linked variant can be used too
     def add(self, equipments):
+        self.resolved.clear()
         for equipment in equipments:
             if equipment.name in self:
                 print('Error {} is defined twice'.format(equipment.name))
@@ -240,12 +381,201 @@ class Armory(dict):
             self[equipment.name] = equipment
 
             if isinstance(equipment, Weapon):
+                self._report(equipment)
                 if equipment.range > 0 and 'Linked' not in equipment.specialRules:
-                    name = 'Linked ' + equipment.name
-                    self[name] = Weapon(name, equipment.range, equipment.attacks, equipment.armorPiercing, ['Linked'] + equipment.weaponRules)
+                    self.linkable[equipment.name] = equipment
+
+    # Name of the equipment defined in the yaml files, from which this one is created
+    def base(self, name):
+        while name in self.variants:
+            name = self.variants[name][0]
+        return name
+
+    # Change the profile of a defined equipment, and of all its variants.
+    # The objects are updated in place, so the units and upgrades which use them see the new profile.
+    # A weapon can't become linkable, or stop being linkable, as other names would be resolved.
+    def redefine(self, equipment):
+        def update(old, new):
+            for attr in type(old).__slots__:
+                setattr(old, attr, getattr(new, attr))
+
+        update(self[equipment.name], equipment)
+        if isinstance(equipment, Weapon):
+            self._report(equipment)
+        # variants are in creation order, so the parent is always updated before
+        for name, (parent, linked) in self.variants.items():
+            if self.base(name) == equipment.name:
+                if linked:
+                    update(self[name], self._linked(name, self[parent]))
+                else:
+                    update(self[name], self._plural(name, self[parent]))
+
+
+# Unit special rules which have an effect on the cost, as bit flags
+RULE_VEHICLE = 1 << 0
+RULE_MONSTER = 1 << 1
+RULE_TITAN = 1 << 2
+RULE_FEAR = 1 << 3
+RULE_AIRDROP = 1 << 4
+RULE_SLOW = 1 << 5
+RULE_FAST = 1 << 6
+RULE_VERY_FAST = 1 << 7
+RULE_STEALTH = 1 << 8
+RULE_GOOD_SHOT = 1 << 9
+RULE_BAD_SHOT = 1 << 10
+RULE_FURIOUS = 1 << 11
+RULE_FEARLESS = 1 << 12
+RULE_AMBUSH = 1 << 13
+RULE_SCOUT = 1 << 14
+RULE_BEACON = 1 << 15
+RULE_STRIDER = 1 << 16
+RULE_FLYING = 1 << 17
+RULE_FLYER = 1 << 18
+RULE_REGENERATION = 1 << 19
+
+RULE_FLAGS = {
+    'Vehicle': RULE_VEHICLE,
+    'Monster': RULE_MONSTER,
+    'Titan': RULE_TITAN,
+    'Fear': RULE_FEAR,
+    'Airdrop': RULE_AIRDROP,
+    'Slow': RULE_SLOW,
+    'Fast': RULE_FAST,
+    'Very Fast': RULE_VERY_FAST,
+    'Stealth': RULE_STEALTH,
+    'Good Shot': RULE_GOOD_SHOT,
+    'Bad Shot': RULE_BAD_SHOT,
+    'Furious': RULE_FURIOUS,
+    'Fearless': RULE_FEARLESS,
+    'Ambush': RULE_AMBUSH,
+    'Scout': RULE_SCOUT,
+    'Beacon': RULE_BEACON,
+    'Strider': RULE_STRIDER,
+    'Flying': RULE_FLYING,
+    'Flyer': RULE_FLYER,
+    'Regeneration': RULE_REGENERATION,
+}
+
+# Everything a set of special rules changes to a unit.
+# defense is added to the unit defense, attackQuality is None if the unit keeps its quality.
+UnitModifiers = namedtuple('UnitModifiers', ['flags', 'speed', 'globalAdd', 'globalMultiplier', 'tough', 'defense',
+                                             'passengers', 'attackQuality', 'defenseQualityDelta', 'stomps'])
+
+monster_stomp = Weapon('Monster Stomp', special=['Impact(3)'])
+titan_stomp = Weapon('Titan Stomp', 0, 6, 2, ['Autohit'])
+
+unit_rules_cache = LRUCache(maxsize=1024)
+
+
+# Return the modifiers of a list of special rules, it is parsed only once for each distinct list.
+def parse_unit_rules(rules):
+    key = tuple(rules)
+    modifiers = unit_rules_cache.get(key)
+    if modifiers is None:
+        modifiers = _parse_unit_rules(key)
+        unit_rules_cache.set(key, modifiers)
+    return modifiers
+
+
+def _parse_unit_rules(rules):
+    flags = 0
+    tough = 1
+    passengers = 0
+    psychic = 0
+    defense = 0
+    stomps = []
+
+    for s in rules:
+        flag = RULE_FLAGS.get(s)
+        if flag:
+            flags |= flag
+        elif s.startswith('Tough('):
+            tough = int(s[6:-1])
+        elif s.startswith('Transport('):
+            passengers = int(s[10:-1])
+        elif s.startswith('Transport+'):
+            passengers += int(s[10:])
+        elif s.startswith('Psychic('):
+            psychic += int(s[8:-1])
+        elif s.startswith('Psychic+'):
+            psychic += int(s[8:])
+        elif s.startswith('Defense+'):
+            defense += int(s[8:])
+
+    if flags & (RULE_VEHICLE | RULE_MONSTER):
+        stomps.append(monster_stomp)
+        flags |= RULE_FEAR
+    if flags & RULE_TITAN:
+        stomps.append(titan_stomp)
+        flags |= RULE_FEAR
+
+    speed = 12
+    if flags & RULE_AIRDROP:
+        speed = 0
+    if flags & RULE_SLOW:
+        speed = 8
+    if flags & RULE_FAST:
+        speed = 18
+    if flags & RULE_VERY_FAST:
+        speed = 24
+    if flags & RULE_STRIDER:
+        speed *= 1.2
+    if flags & RULE_FLYING:
+        speed *= 1.3
+    # Flyers moves 36" but only in straight line.
+    if flags & RULE_FLYER:
+        speed = 24
+
+    attackQuality = None
+    if flags & RULE_GOOD_SHOT:
+        attackQuality = 4
+    if flags & RULE_BAD_SHOT:
+        attackQuality = 5
+
+    globalAdd = 0
+    if flags & RULE_FURIOUS:
+        globalAdd = 1
+    if flags & RULE_BEACON:
+        globalAdd += 10
+    if flags & RULE_FEAR:
+        globalAdd += 5
+    globalAdd += psychic * 7
+
+    globalMultiplier = 0
+    if flags & RULE_AMBUSH:
+        if flags & RULE_SCOUT:
+            # Ambush and scout doesn't stack, since you can't use both
+            globalMultiplier += 0.2
+        else:
+            globalMultiplier += 0.10
+    if flags & RULE_SCOUT:
+        globalMultiplier += 0.15
+
+    # Stealth is like +0.5 def, because it works only against ranged attack
+    if flags & RULE_STEALTH:
+        defense += 0.5
+
+    if flags & RULE_REGENERATION:
+        tough *= 4 / 3
+
+    defenseQualityDelta = -1 if flags & RULE_FEARLESS else 0
+
+    return UnitModifiers(flags, speed, globalAdd, globalMultiplier, tough, defense,
+                         passengers, attackQuality, defenseQualityDelta, tuple(stomps))
+
+
+def missingEquipment(name, equipment, equipments):
+    return "ERROR unit {0}, '{1}' not in current equipments '{2}'".format(name, equipment, equipments)
 
 
 class Unit:
+    # Units are created for each upgrade evaluation, so slots keep them small
+    __slots__ = ('name', 'specialRules', 'equipments', 'quality', 'basedefense', 'count', 'upgrades',
+                 'factionCost', 'sharedEquipments', 'wargearSp',
+                 'speed', 'globalAdd', 'globalMultiplier', 'tough', 'defense', 'spEquipments', 'passengers',
+                 'attackQuality', 'defenseQuality',
+                 'defenseCost', 'modelAttackCost', 'attackCost', 'otherCost', 'cost')
+
     def __init__(self, name='Unknown Unit', count=1, quality=4, defense=2, equipments=[], special=[]):
         self.name = name
         self.specialRules = special
@@ -255,6 +585,7 @@ class Unit:
         self.count = count
         self.upgrades = []
         self.factionCost = 0
+        self.sharedEquipments = False
 
         self.Update()
 
@@ -268,58 +599,114 @@ class Unit:
         pretty += 'Defense {0} pts, Attack {1} pts, Other {2} pts\n'.format(self.defenseCost, self.attackCost, self.otherCost)
         return pretty
 
+    # Snapshot of the unit, without faction cost and upgrades.
+    # The equipment list and all the computed costs are shared with the original unit,
+    # the equipment list is copied only when one of them is modified.
     def __copy__(self):
-        return Unit(self.name, self.count, self.quality, self.basedefense, self.equipments.copy(), self.specialRules.copy())
+        snapshot = type(self).__new__(type(self))
+        for attr in Unit.__slots__:
+            setattr(snapshot, attr, getattr(self, attr))
+        snapshot.upgrades = []
+        snapshot.sharedEquipments = True
+        self.sharedEquipments = True
+        snapshot.SetFactionCost(0)
+        return snapshot
+
+    def _OwnEquipments(self):
+        if self.sharedEquipments:
+            self.equipments = self.equipments.copy()
+            self.sharedEquipments = False
 
     @classmethod
     def from_dict(self, data, armory):
         data['equipments'] = armory.get(data.pop('equipment'))
         return self(**data)
 
+    # Everything the cost of the unit and its upgrades depends on, except the faction rules
+    def Key(self):
+        return (self.count, self.quality, self.basedefense, tuple(self.specialRules), tuple(e.Key() for e in self.equipments))
+
     def Update(self):
         self.wargearSp = [sp for equ in self.equipments for sp in equ.specialRules]
         self.parseSpecialRules()
         self.Cost()
 
+    # Equipments without special rules don't change speed, quality or toughness,
+    # so only the attack cost has to be updated.
     def AddEquipments(self, equipments):
+        self._OwnEquipments()
         self.equipments += equipments
-        self.Update()
-
-    def RemoveEquipment(self, e):
+        if any(equ.specialRules for equ in equipments):
+            self.Update()
+            return
+        self.modelAttackCost += sum(equ.Cost(self.speed, self.attackQuality) for equ in equipments)
+        self.UpdateAttackCost()
+
+    # return the removed equipment, or None if it's not found
+    # If errors is a list, a missing equipment is added to it as (equipment, current equipments)
+    # instead of being printed, so the caller can report it.
+    def RemoveEquipment(self, e, errors=None):
+        self._OwnEquipments()
         if e in self.equipments:
             self.equipments.remove(e)
-            return
+            return e
 
         if e.name.endswith('s'):
             singular = e.name[:-1]
             for equ in self.equipments:
                 if singular == equ.name:
                     self.equipments.remove(equ)
-                return
-
-        print("ERROR unit {0}, '{1}' not in current equipments '{2}'".format(self.name, e, self.equipments))
+                    return equ
+                return None
 
-    def RemoveEquipments(self, equipments):
-        for e in equipments:
-            self.RemoveEquipment(e)
+        if errors is not None:
+            errors.append((str(e), str(self.equipments)))
+        else:
+            print(missingEquipment(self.name, e, self.equipments))
+        return None
 
-        self.Update()
+    def RemoveEquipments(self, equipments, errors=None):
+        removed = [self.RemoveEquipment(e, errors) for e in equipments]
+        removed = [equ for equ in removed if equ]
+        if any(equ.specialRules for equ in removed):
+            self.Update()
+            return
+        self.modelAttackCost -= sum(equ.Cost(self.speed, self.attackQuality) for equ in removed)
+        self.UpdateAttackCost()
 
+    # Count doesn't change special rules, so the attack cost per model is kept
     def SetCount(self, count):
         self.count = count
-        self.Cost()
+        self.DefenseCost()
+        self.UpdateAttackCost()
 
     def SetFactionCost(self, cost):
         self.factionCost = cost
-        self.Cost()
+        self.cost = self.defenseCost + self.attackCost + self.otherCost + self.factionCost
 
+    # Cost of the unit with more equipments, without the faction cost, and without modifying the unit.
+    # Return None if the equipments have special rules, as the whole unit must be updated.
+    def CostWithEquipments(self, equipments):
+        if any(equ.specialRules for equ in equipments):
+            return None
+        modelAttackCost = self.modelAttackCost + sum(equ.Cost(self.speed, self.attackQuality) for equ in equipments)
+        attackCost = modelAttackCost * self.count
+        return self.defenseCost + attackCost + self._OtherCost(attackCost)
+
+    # Weapon costs are integer, so the attack cost is exactly count times the cost for one model
     def AttackCost(self):
-        self.attackCost = 0
+        self.modelAttackCost = 0
 
         for w in self.equipments + self.spEquipments:
-            self.attackCost += w.Cost(self.speed, self.attackQuality) * self.count
+            self.modelAttackCost += w.Cost(self.speed, self.attackQuality)
+
+        self.attackCost = self.modelAttackCost * self.count
 
-        self.attackCost = int(round(self.attackCost))
+    # Recompute only what depends on the attack cost
+    def UpdateAttackCost(self):
+        self.attackCost = self.modelAttackCost * self.count
+        self.OtherCost()
+        self.cost = self.defenseCost + self.attackCost + self.otherCost + self.factionCost
 
     def DefenseCost(self):
         self.defenseCost = quality_defense_factor(self.defenseQuality) * defense_cost(self.defense) * self.tough
@@ -328,13 +715,16 @@ class Unit:
         self.defenseCost *= adjust_defense_cost * self.count
         self.defenseCost = int(round(self.defenseCost))
 
+    def _OtherCost(self, attackCost):
+        otherCost = self.globalAdd
+        # For transporter, the cost depends on defense, and speed
+        otherCost += self.passengers * (self.defenseCost / 150) * (self.speed / 12)
+        otherCost += (attackCost + self.defenseCost) * self.globalMultiplier
+        return int(round(otherCost))
+
     # attack and defense cost should already be computed
     def OtherCost(self):
-        self.otherCost = self.globalAdd
-        # For transporter, the cost depends on defense, and speed
-        self.otherCost += self.passengers * (self.defenseCost / 150) * (self.speed / 12)
-        self.otherCost += (self.attackCost + self.defenseCost) * self.globalMultiplier
-        self.otherCost = int(round(self.otherCost))
+        self.otherCost = self._OtherCost(self.attackCost)
 
     def Cost(self):
         self.DefenseCost()
@@ -345,86 +735,16 @@ class Unit:
         return self.cost
 
     def parseSpecialRules(self):
-        self.speed = 12
-        self.globalAdd = 0
-        self.globalMultiplier = 0
-        self.tough = 1
-        self.defense = self.basedefense
-        self.spEquipments = []
-        self.passengers = 0
-        self.attackQuality = self.quality
-        self.defenseQuality = self.quality
-
-        specialRules = self.specialRules + self.wargearSp
-
-        if 'Vehicle' in specialRules or 'Monster' in specialRules:
-            smallStomp = Weapon('Monster Stomp', special=['Impact(3)'])
-            self.spEquipments.append(smallStomp)
-            if 'Fear' not in specialRules:
-                specialRules.append('Fear')
-
-        if 'Titan' in specialRules:
-            titanStomp = Weapon('Titan Stomp', 0, 6, 2, ['Autohit'])
-            self.spEquipments.append(titanStomp)
-            if 'Fear' not in specialRules:
-                specialRules.append('Fear')
-
-        if 'Airdrop' in specialRules:
-            self.speed = 0
-        if 'Slow' in specialRules:
-            self.speed = 8
-        if 'Fast' in specialRules:
-            self.speed = 18
-        if 'Very Fast' in specialRules:
-            self.speed = 24
-        if 'Stealth' in specialRules:
-            # Stealth is like +0.5 def, because it works only against ranged attack
-            self.defense += 0.5
-        if 'Good Shot' in specialRules:
-            self.attackQuality = 4
-        if 'Bad Shot' in specialRules:
-            self.attackQuality = 5
-        if 'Furious' in specialRules:
-            self.globalAdd = 1
-        if 'Fearless' in specialRules:
-            self.defenseQuality -= 1
-
-        if 'Ambush' in specialRules:
-            if 'Scout' in specialRules:
-                # Ambush and scout doesn't stack, since you can't use both
-                self.globalMultiplier += 0.2
-            else:
-                self.globalMultiplier += 0.10
-        if 'Scout' in specialRules:
-            self.globalMultiplier += 0.15
-        if 'Beacon' in specialRules:
-            self.globalAdd += 10
-        if 'Fear' in specialRules:
-            self.globalAdd += 5
-        if 'Strider' in specialRules:
-            self.speed *= 1.2
-        if 'Flying' in specialRules:
-            self.speed *= 1.3
-        # Flyers moves 36" but only in straight line.
-        if 'Flyer' in specialRules:
-            self.speed = 24
-
-        for s in specialRules:
-            if s.startswith('Tough('):
-                self.tough = int(s[6:-1])
-            elif s.startswith('Transport('):
-                self.passengers = int(s[10:-1])
-            elif s.startswith('Transport+'):
-                self.passengers += int(s[10:])
-            elif s.startswith('Psychic('):
-                self.globalAdd += int(s[8:-1]) * 7
-            elif s.startswith('Psychic+'):
-                self.globalAdd += int(s[8:]) * 7
-            elif s.startswith('Defense+'):
-                self.defense += int(s[8:])
-
-        if 'Regeneration' in specialRules:
-            self.tough *= 4 / 3
+        m = parse_unit_rules(self.specialRules + self.wargearSp)
+        self.speed = m.speed
+        self.globalAdd = m.globalAdd
+        self.globalMultiplier = m.globalMultiplier
+        self.tough = m.tough
+        self.defense = self.basedefense + m.defense
+        self.spEquipments = list(m.stomps)
+        self.passengers = m.passengers
+        self.attackQuality = self.quality if m.attackQuality is None else m.attackQuality
+        self.defenseQuality = self.quality + m.defenseQualityDelta
 
 
 def main():
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os
+import json
+import time
+import contextlib
+from onepagepoints import Weapon, Unit
+
+"""
+Profiling of the faction builds.
+Each phase (yaml read, armory, units, upgrade costs, renderers, file write) is
+timed, and the calls of the main cost methods are counted. Results are printed
+as a table, and can be saved as a Chrome trace (open it in chrome://tracing or
+https://ui.perfetto.dev).
+When the profiler is disabled, a phase is just an empty context manager, and
+no method is instrumented.
+"""
+
+# methods which are counted when the profiler is enabled
+counted_methods = [(Weapon, 'Cost'), (Unit, 'Update')]
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.counts = {}
+        self.originals = []
+        self.disabled = contextlib.nullcontext()
+
+    # Start recording, and wrap the counted methods
+    def enable(self, methods=counted_methods):
+        if self.enabled:
+            return
+        self.enabled = True
+        for cls, name in methods:
+            func = getattr(cls, name)
+            self.originals.append((cls, name, func))
+            setattr(cls, name, self._counter(cls.__name__ + '.' + name, func))
+
+    # Stop recording, and restore the counted methods
+    def disable(self):
+        for cls, name, func in self.originals:
+            setattr(cls, name, func)
+        self.originals = []
+        self.enabled = False
+
+    def _counter(self, key, func):
+        counts = self.counts
+
+        def counted(*args, **kwargs):
+            counts[key] = counts.get(key, 0) + 1
+            return func(*args, **kwargs)
+        return counted
+
+    # Time a phase, phases can be nested
+    def phase(self, name, **args):
+        if not self.enabled:
+            return self.disabled
+        return self._phase(name, args)
+
+    @contextlib.contextmanager
+    def _phase(self, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, start, time.perf_counter() - start, os.getpid(), args))
+
+    # Return the recorded events and counts, and reset them
+    # used to send the results of a worker process to the main one.
+    def take(self):
+        data = (self.events, dict(self.counts))
+        self.events = []
+        self.counts.clear()
+        return data
+
+    def merge(self, data):
+        events, counts = data
+        self.events += events
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    # Return a list of (phase, calls, total time) in order of first appearance
+    def phases(self):
+        totals = {}
+        for name, start, duration, pid, args in sorted(self.events, key=lambda e: e[1]):
+            calls, total = totals.get(name, (0, 0))
+            totals[name] = (calls + 1, total + duration)
+        return [(name, calls, total) for name, (calls, total) in totals.items()]
+
+    def summary(self):
+        lines = ['{:<30} {:>8} {:>12} {:>12}'.format('Phase', 'Calls', 'Total ms', 'Mean ms')]
+        for name, calls, total in self.phases():
+            lines.append('{:<30} {:>8} {:>12.3f} {:>12.3f}'.format(name, calls, total * 1000, total * 1000 / calls))
+        lines.append('')
+        lines.append('{:<30} {:>8}'.format('Method', 'Calls'))
+        for key, count in sorted(self.counts.items()):
+            lines.append('{:<30} {:>8}'.format(key, count))
+        return '\n'.join(lines)
+
+    # Chrome trace event format, with one complete event per phase
+    # and the method counts as metadata
+    def trace(self):
+        events = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': 0, 'args': args}
+                  for name, start, duration, pid, args in self.events]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'counts': self.counts}}
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+profiler = Profiler()
+
+
+# Print the summary and write the trace in filename
+def report(filename):
+    print(profiler.summary())
+    profiler.write(filename)
+    print('Chrome trace written to {}'.format(filename))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import io
+import json
+import asyncio
+import argparse
+import contextlib
+import urllib.parse
+from onepagepoints import Weapon, Unit
+from onepagebatch import Faction, read_common
+
+"""
+Local HTTP/JSON points server.
+All factions are loaded once, then each request is answered from memory:
+  GET  /factions                   list of factions, with their units and upgrade groups
+  GET  /units?faction=Tao          cost of all units of a faction
+  POST /unit     {"faction": "Tao", "unit": "Fire Warriors" or {"name":..., "count":..., "quality":..., "defense":..., "equipment": [...], "special": [...]}}
+  POST /upgrade  {"faction": "Tao", "unit": ..., "group": 0, "upgrade": 0, "option": 1}  (option is optional)
+  POST /weapon   {"weapon": {"name":..., "range":..., "attacks":..., "ap":..., "special": [...]}, "speed": 12, "quality": 4}
+  POST /reload   read the yaml files again, and update the factions
+group and upgrade are the indexes in upgrades.yml, and option is the index in the "add" list.
+The server only uses the standard library, and listens on localhost.
+"""
+
+default_factions = ['Battle_Brothers', 'High_Elf_Fleets', 'Robot_Legions', 'Tao', 'Orc']
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def isIndex(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def isNames(value):
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+
+# Check the type of the fields present in a request object,
+# checks is {field: (test, description of the expected type)}
+def checkFields(data, checks):
+    for field, (test, expected) in checks.items():
+        if field in data and not test(data[field]):
+            raise RequestError(400, '{} should be {}'.format(field, expected))
+
+
+def inRange(low, high=None):
+    return lambda value: isIndex(value) and value >= low and (high is None or value <= high)
+
+
+def positive(value):
+    return isNumber(value) and value >= 0
+
+
+# quality and defense are the values of units.yml, 2+ to 6+, and 2+ to 10+
+unitChecks = {'name': (lambda v: isinstance(v, str), 'a string'),
+              'count': (inRange(1), 'an integer, at least 1'),
+              'quality': (inRange(2, 6), 'an integer from 2 to 6'),
+              'defense': (inRange(2, 10), 'an integer from 2 to 10'),
+              'equipment': (isNames, 'a list of names'),
+              'special': (isNames, 'a list of names')}
+
+weaponChecks = {'name': (lambda v: isinstance(v, str), 'a string'),
+                'range': (positive, 'a positive number'),
+                'attacks': (positive, 'a positive number'),
+                'ap': (positive, 'a positive number'),
+                'special': (isNames, 'a list of names')}
+
+
+def unitCosts(unit):
+    return {'name': unit.name, 'count': unit.count, 'cost': unit.cost, 'defenseCost': unit.defenseCost,
+            'attackCost': unit.attackCost, 'otherCost': unit.otherCost, 'factionCost': unit.factionCost}
+
+
+class PointsService:
+    # The factions logs (Processing...) are not printed
+    def __init__(self, factionNames):
+        self.factionNames = factionNames
+        with contextlib.redirect_stdout(io.StringIO()):
+            common = read_common()
+            self.factions = {name: Faction(name, common) for name in factionNames}
+        self._index()
+
+    def _index(self):
+        self.units = {name: {unit.name: unit for unit in faction.units} for name, faction in self.factions.items()}
+
+    def reload(self, body):
+        updated = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            common = read_common()
+            for name in self.factionNames:
+                invalid = self.factions[name].update(common)
+                if invalid is None:
+                    self.factions[name] = Faction(name, common)
+                    updated[name] = 'rebuilt'
+                else:
+                    updated[name] = {'units': len(invalid.units), 'options': len(invalid.options)}
+        self._index()
+        return updated
+
+    def _faction(self, body):
+        name = body.get('faction')
+        if not isinstance(name, str) or name not in self.factions:
+            raise RequestError(404, 'Unknown faction {}'.format(name))
+        return self.factions[name]
+
+    # unit is the name of a unit of the faction, or an ad-hoc unit like in units.yml
+    def _unit(self, faction, data):
+        if isinstance(data, str):
+            unit = self.units[faction.name].get(data)
+            if unit is None:
+                raise RequestError(404, 'Unknown unit {}'.format(data))
+            return unit
+        if not isinstance(data, dict):
+            raise RequestError(400, 'unit should be a name or an object')
+
+        checkFields(data, unitChecks)
+        data = dict(data)
+        data.setdefault('equipment', [])
+        unknown = [name for name in data['equipment'] if None in faction.armory.resolve(name)]
+        if unknown:
+            raise RequestError(400, 'Unknown equipments {}'.format(unknown))
+        try:
+            unit = Unit.from_dict(data, faction.armory)
+        except TypeError as e:
+            raise RequestError(400, 'Bad unit: {}'.format(e))
+        unit.SetFactionCost(faction.getFactionCost(unit))
+        return unit
+
+    def factionList(self, body):
+        return [{'name': name, 'title': faction.title, 'units': [unit.name for unit in faction.units],
+                 'groups': [group.units for group in faction.upgrades]} for name, faction in self.factions.items()]
+
+    def unitList(self, body):
+        return [unitCosts(unit) for unit in self._faction(body).units]
+
+    def unitCost(self, body):
+        faction = self._faction(body)
+        return unitCosts(self._unit(faction, body.get('unit')))
+
+    # cost is the exact cost of the option for this unit,
+    # and published is the mean cost for all units of the group, which is printed.
+    def upgradeCost(self, body):
+        faction = self._faction(body)
+        unit = self._unit(faction, body.get('unit'))
+        checkFields(body, {'group': (isIndex, 'an integer'), 'upgrade': (isIndex, 'an integer'), 'option': (isIndex, 'an integer')})
+        try:
+            upgrade = faction.upgrades[body['group']][body['upgrade']]
+        except (KeyError, IndexError, TypeError):
+            raise RequestError(404, 'Unknown upgrade {} {}'.format(body.get('group'), body.get('upgrade')))
+        costs = upgrade.Cost_unit(unit)
+        options = [{'option': o, 'cost': cost, 'published': upgrade.cost[o]} for o, cost in enumerate(costs)]
+        if 'option' in body:
+            if body['option'] not in range(len(options)):
+                raise RequestError(404, 'Unknown option {}'.format(body['option']))
+            return options[body['option']]
+        return {'text': upgrade.text, 'options': options}
+
+    def weaponCost(self, body):
+        if not isinstance(body.get('weapon') or {}, dict):
+            raise RequestError(400, 'weapon should be an object')
+        checkFields(body, {'speed': (lambda v: isNumber(v) and v > 0, 'a number above 0'), 'quality': (inRange(2, 6), 'an integer from 2 to 6')})
+        data = dict(body.get('weapon') or {})
+        checkFields(data, weaponChecks)
+        try:
+            weapon = Weapon(data.pop('name', 'Weapon'), **data)
+            cost = weapon.Cost(body.get('speed', 12), body.get('quality', 4))
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, 'Bad weapon: {}'.format(e))
+        return {'name': weapon.name, 'cost': cost, 'profile': weapon.Profile(), 'unknownRules': weapon.unknownRules}
+
+    # return the http status and the json answer
+    def handle(self, method, path, body):
+        path, _, query = path.partition('?')
+        routes = {('GET', '/factions'): self.factionList,
+                  ('GET', '/units'): self.unitList,
+                  ('POST', '/unit'): self.unitCost,
+                  ('POST', '/upgrade'): self.upgradeCost,
+                  ('POST', '/weapon'): self.weaponCost,
+                  ('POST', '/reload'): self.reload}
+        if (method, path) not in routes:
+            if any(p == path for m, p in routes):
+                return 405, {'error': 'Method {} not allowed'.format(method)}
+            return 404, {'error': 'Unknown path {}'.format(path)}
+        try:
+            if method == 'GET':
+                body = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+            elif body:
+                body = json.loads(body)
+            else:
+                body = {}
+            if not isinstance(body, dict):
+                raise RequestError(400, 'The request should be a json object')
+            return 200, routes[(method, path)](body)
+        except RequestError as e:
+            return e.status, {'error': str(e)}
+        except ValueError as e:
+            return 400, {'error': 'Bad json: {}'.format(e)}
+        except Exception as e:
+            return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+# Minimal HTTP/1.1 server, with keep-alive
+async def handleClient(service, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                method, path, version = line.decode('latin-1').split()
+            except ValueError:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+            try:
+                length = int(headers.get('content-length', 0))
+                if length < 0:
+                    raise ValueError('negative length')
+            except ValueError:
+                # the end of the body is unknown, so the connection can't be reused
+                status, answer, close = 400, {'error': 'Bad Content-Length {}'.format(headers['content-length'])}, True
+            else:
+                body = await reader.readexactly(length)
+                try:
+                    status, answer = service.handle(method, path, body.decode('utf-8'))
+                except UnicodeDecodeError as e:
+                    status, answer = 400, {'error': 'The request should be utf-8: {}'.format(e)}
+            data = json.dumps(answer).encode('utf-8')
+            writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n{}\r\n'.format(
+                status, reasons[status], len(data), 'Connection: close\r\n' if close else '').encode('latin-1') + data)
+            await writer.drain()
+            if close:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host, port):
+    server = await asyncio.start_server(lambda r, w: handleClient(service, r, w), host, port)
+    print('Serving {} on http://{}:{}'.format(', '.join(service.factionNames), host, port))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HTTP server to compute the cost of units, upgrades and weapons')
+    parser.add_argument('-p', '--port', type=int, default=8420,
+                        help='port to listen on')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to listen on, only localhost by default')
+    parser.add_argument('factions', type=str, nargs='*', default=default_factions,
+                        help='path to the faction (should contain at list equipments.yml, units.yml, upgrades.yml)')
+
+    args = parser.parse_args()
+
+    service = PointsService([name.strip('/') for name in args.factions])
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2018 Jocelyn Falempe kdj0c@djinvi.net
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import numpy as np
+import onepagepoints
+from onepagepoints import Weapon, WarGear
+
+"""
+Vectorized version of Weapon.Cost and Unit.Cost.
+It converts a list of weapons (or a whole armory) and a list of units into numpy
+arrays, so thousands of costs can be computed at once.
+The results are exactly the same as the one from onepagepoints.
+"""
+
+
+# Weapon modifiers as a tuple of floats, the forced quality is NaN if there is none
+def weapon_factors(weapon):
+    m = weapon.modifiers
+    quality = np.nan if m.quality is None else m.quality
+    return (m.range, m.attacks, m.ap, m.factor, m.impact, m.rending, quality, m.qualityDelta)
+
+
+# Return all the weapons of an armory, including the one inside a wargear
+def armory_weapons(armory):
+    weapons = []
+    for equipment in armory.values():
+        if isinstance(equipment, Weapon):
+            weapons.append(equipment)
+        elif isinstance(equipment, WarGear):
+            weapons.extend(equipment.weapons)
+    return weapons
+
+
+def _range_cost(wrange, speed):
+    return np.where(wrange == 0, speed ** 0.75, (wrange + speed / 2) ** 0.75)
+
+
+# Arrays version of the weapon profiles
+class WeaponArrays:
+    def __init__(self, weapons):
+        self.weapons = list(weapons)
+        factors = np.array([weapon_factors(w) for w in self.weapons], dtype=np.float64).reshape(-1, 8)
+        (self.range, self.attacks, self.ap, self.sfactor,
+         self.impact, self.rending, self.quality, self.qdelta) = factors.T
+
+    def __len__(self):
+        return len(self.weapons)
+
+    @classmethod
+    def from_armory(self, armory):
+        return self(armory_weapons(armory))
+
+    # Cost of each weapon, speed and quality are broadcasted with the weapon
+    # arrays, so use the shape (1, n) to get the cost of every weapons for n
+    # speed/quality pairs, or the shape (len(self),) for one pair per weapon.
+    def cost(self, speed, quality):
+        speed = np.asarray(speed, dtype=np.float64)
+        quality = np.asarray(quality, dtype=np.float64)
+        extra = (1,) * (max(speed.ndim, quality.ndim, 1) - 1)
+
+        def col(a):
+            return a.reshape(a.shape + extra)
+
+        wrange, attacks, ap, sfactor = col(self.range), col(self.attacks), col(self.ap), col(self.sfactor)
+        impact, rending, wquality, qdelta = col(self.impact), col(self.rending), col(self.quality), col(self.qdelta)
+
+        quality = np.where(np.isnan(wquality), quality, wquality) + qdelta
+        rcost = _range_cost(wrange, speed)
+        apcost = 1.2 ** ap
+
+        cost = sfactor * attacks * rcost * (apcost * ((7.0 - quality) / 6.0) + rending)
+        cost = np.where(impact != 0, cost + 0.5 * impact * sfactor * apcost * rcost, cost)
+        return np.rint(cost * onepagepoints.adjust_attack_cost).astype(np.int64)
+
+
+# Compute the cost of all weapons for each speed and quality
+# return an array of shape (len(weapons), len(speeds))
+def weapon_costs(weapons, speeds, qualities):
+    if not isinstance(weapons, WeaponArrays):
+        weapons = WeaponArrays(weapons)
+    speeds = np.atleast_1d(np.asarray(speeds, dtype=np.float64))[np.newaxis, :]
+    qualities = np.atleast_1d(np.asarray(qualities, dtype=np.float64))[np.newaxis, :]
+    return weapons.cost(speeds, qualities)
+
+
+# Arrays version of units, the special rules are already parsed by the Unit class
+class UnitArrays:
+    def __init__(self, units):
+        self.units = list(units)
+
+        def attr(name):
+            return np.array([getattr(u, name) for u in self.units], dtype=np.float64)
+
+        self.count = attr('count')
+        self.speed = attr('speed')
+        self.attackQuality = attr('attackQuality')
+        self.defenseQuality = attr('defenseQuality')
+        self.defense = attr('defense')
+        self.tough = attr('tough')
+        self.passengers = attr('passengers')
+        self.globalAdd = attr('globalAdd')
+        self.globalMultiplier = attr('globalMultiplier')
+        self.factionCost = attr('factionCost')
+
+        # flatten all weapons of all units (wargear weapons included)
+        weapons = []
+        owner = []
+        for i, u in enumerate(self.units):
+            for equ in u.equipments + u.spEquipments:
+                ws = equ.weapons if isinstance(equ, WarGear) else [equ]
+                weapons.extend(ws)
+                owner.extend([i] * len(ws))
+        self.weapons = WeaponArrays(weapons)
+        self.owner = np.array(owner, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.units)
+
+    @classmethod
+    def from_faction(self, faction):
+        return self(faction.units)
+
+    def defense_cost(self):
+        d = self.defense
+        cost = (1.0 - 0.1 * (self.defenseQuality - 2.0)) * ((0.9 * d * d + d + 10.0) / 2.0) * self.tough
+        cost *= (self.speed + 24) / (36)
+        cost *= onepagepoints.adjust_defense_cost * self.count
+        return np.rint(cost)
+
+    def attack_cost(self):
+        speed = self.speed[self.owner]
+        quality = self.attackQuality[self.owner]
+        wcost = self.weapons.cost(speed, quality) * self.count[self.owner]
+        return np.rint(np.bincount(self.owner, weights=wcost, minlength=len(self.units)))
+
+    # return a dictionnary with the array of each cost part, and the total
+    def cost(self):
+        defense = self.defense_cost()
+        attack = self.attack_cost()
+        other = self.globalAdd + self.passengers * (defense / 150) * (self.speed / 12)
+        other = np.rint(other + (attack + defense) * self.globalMultiplier)
+        total = defense + attack + other + self.factionCost
+        return {'defenseCost': defense.astype(np.int64),
+                'attackCost': attack.astype(np.int64),
+                'otherCost': other.astype(np.int64),
+                'cost': total.astype(np.int64)}
+
+
+def unit_costs(units):
+    return UnitArrays(units).cost()
@@ -21,7 +21,15 @@ IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from onepagepoints import Weapon, WarGear, Unit
+import os
+import sys
+import copy
+import pytest
+from generate_synthetic import generate
+from build import PdfJob, runJobs
+from onepagecache import YamlCache
+from onepageprofile import Profiler
+from onepagepoints import Weapon, WarGear, Unit, Armory, LRUCache, weapon_cost_cache, parse_unit_rules, RULE_FEAR
 
 
 # due to rounding error, check if a == b (+-1)
@@ -63,3 +71,460 @@ def test_Unit_count():
     unit = Unit()
     unit2 = Unit(count=2)
     assert(unit.cost * 2 == unit2.cost)
+
+
+# Same profile should be priced only once, and invalidate() drops the cached costs
+def test_Weapon_cost_cache():
+    weapon_cost_cache.invalidate()
+    knife = Weapon('Dummy', 12, 3, 1)
+    sameknife = Weapon('Same Dummy', 12, 3, 1)
+    hits = weapon_cost_cache.hits
+    cost = knife.Cost(12, 4)
+    assert(sameknife.Cost(12, 4) == cost)
+    assert(weapon_cost_cache.hits == hits + 1)
+    weapon_cost_cache.invalidate()
+    assert(len(weapon_cost_cache) == 0)
+    assert(knife.Cost(12, 4) == cost)
+
+
+def test_LRUCache():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert(cache.get('b') is None)
+    assert(cache.get('a') == 1)
+
+
+# numpy costs should be exactly the same as Weapon.Cost and Unit.Cost
+def test_vector_costs():
+    ov = pytest.importorskip('onepagevector')
+    weapons = [Weapon('Dummy', 12, 1, 0), Weapon('Dummy', 0, 'D3+1', 2, ['Rending', 'Poison(3)']),
+               Weapon('Dummy', 24, 2, 1, ['Linked', 'Sniper']), Weapon('Dummy', 36, 1, 4, ['Blast(3)', 'Indirect', 'Limited']),
+               Weapon('Dummy', 0, 3, 0, ['Impact(3)', 'Deadly']), Weapon('Dummy', 18, 2, 1, ['Flux', 'Autohit', 'Anti-Air'])]
+    costs = ov.weapon_costs(weapons, [12, 18, 14.4], [4, 5, 3])
+    assert([list(c) for c in costs] == [[w.Cost(12, 4), w.Cost(18, 5), w.Cost(14.4, 3)] for w in weapons])
+
+    units = [Unit('Grunt', 5, 5, 4, weapons[:2], ['Good Shot', 'Tough(3)']),
+             Unit('Tank', 1, 4, 9, weapons[2:], ['Vehicle', 'Transport(6)', 'Fast', 'Scout', 'Ambush'])]
+    costs = ov.unit_costs(units)
+    assert(list(costs['cost']) == [u.cost for u in units])
+
+
+# Special rules are parsed once, the order of Linked/Sniper matters
+def test_Weapon_modifiers():
+    sniper = Weapon('Dummy', 24, 1, 0, ['Linked', 'Sniper'])
+    assert(sniper.modifiers.quality == 2 and sniper.modifiers.qualityDelta == 0)
+    sniper = Weapon('Dummy', 24, 1, 0, ['Sniper', 'Linked'])
+    assert(sniper.modifiers.quality == 2 and sniper.modifiers.qualityDelta == -1)
+    poison = Weapon('Dummy', 0, 'D3', 1, ['Poison(3)', 'EMP'])
+    assert(poison.modifiers.ap == 2.5 and poison.modifiers.attacks == 2)
+    assert(poison.unknownRules == ['EMP'])
+
+
+# Special rules of the unit and its wargear are parsed once per distinct list
+def test_Unit_rules():
+    rules = parse_unit_rules(['Tough(3)', 'Monster', 'Fast', 'Psychic(2)', 'Regeneration'])
+    assert(rules.flags & RULE_FEAR)
+    assert(rules.speed == 18 and rules.tough == 4 and rules.globalAdd == 19)
+    assert(parse_unit_rules(('Tough(3)', 'Monster', 'Fast', 'Psychic(2)', 'Regeneration')) is rules)
+    unit = Unit('Grunt', 5, 5, 4, [], ['Good Shot', 'Fearless'])
+    assert(unit.attackQuality == 4 and unit.defenseQuality == 4)
+
+
+# Adding or removing weapons updates only the attack cost, it must match a full update
+def test_Unit_incremental():
+    rifle = Weapon('Rifle', 24, 1, 0)
+    cannon = Weapon('Cannon', 36, 2, 2, ['Blast(3)'])
+    unit = Unit('Grunt', 5, 5, 4, [rifle], ['Scout', 'Tough(3)'])
+    unit.AddEquipments([cannon])
+    assert(unit.cost == Unit('Grunt', 5, 5, 4, [rifle, cannon], ['Scout', 'Tough(3)']).cost)
+    assert(unit.CostWithEquipments([cannon]) == Unit('Grunt', 5, 5, 4, [rifle, cannon, cannon], ['Scout', 'Tough(3)']).cost)
+    unit.RemoveEquipments([rifle])
+    unit.SetCount(3)
+    assert(unit.cost == Unit('Grunt', 3, 5, 4, [cannon], ['Scout', 'Tough(3)']).cost)
+
+
+# A copy shares the equipments until one of them is modified
+def test_Unit_copy():
+    rifle = Weapon('Rifle', 24, 1, 0)
+    unit = Unit('Grunt', 5, 5, 4, [rifle], ['Scout'])
+    unit.SetFactionCost(10)
+    snapshot = copy.copy(unit)
+    assert(snapshot.equipments is unit.equipments)
+    assert(snapshot.cost == unit.cost - 10)
+    snapshot.AddEquipments([rifle])
+    assert(unit.equipments == [rifle] and snapshot.equipments == [rifle, rifle])
+    unit.RemoveEquipments([rifle])
+    assert(snapshot.equipments == [rifle, rifle])
+
+
+# Parsed yaml is cached, but each load returns a new copy
+def test_YamlCache():
+    cache = YamlCache(path=None)
+    data = cache.load('weapons:\n  Rifle: {range: 24, attacks: 1}\n')
+    data['weapons']['Rifle']['range'] = 12
+    again = cache.load('weapons:\n  Rifle: {range: 24, attacks: 1}\n')
+    assert(again == {'weapons': {'Rifle': {'range': 24, 'attacks': 1}}})
+    assert(cache.hits == 1 and cache.misses == 1)
+
+
+# Names are resolved without modifying the list, with plural and "2x" prefix
+def test_Armory_get():
+    armory = Armory()
+    armory.add([Weapon('Rifle', 24, 1, 0), Weapon('Claw', 0, 2, 1)])
+    names = ['2x Rifles', 'Linked Rifle', 'Claw']
+    equipments = armory.get(names)
+    assert(names == ['2x Rifles', 'Linked Rifle', 'Claw'])
+    assert([e.name for e in equipments] == ['Rifles', 'Rifles', 'Linked Rifle', 'Claw'])
+    assert(equipments[0] is equipments[1] and armory.get(['Rifles'])[0] is equipments[0])
+
+
+# Linked variants are created only when they are used
+def test_Armory_linked():
+    armory = Armory()
+    armory.add([Weapon('Rifle', 24, 1, 0), Weapon('Claw', 0, 2, 1)])
+    assert('Linked Rifle' not in armory)
+    linked = armory.get(['Linked Rifles'])[0]
+    assert(linked.name == 'Linked Rifles' and linked.weaponRules == ['Linked'])
+    assert('Linked Rifle' in armory)
+    assert(armory.getOne('Linked Claw') is None)
+
+
+# The same seed always gives the same faction, and it can be built
+def test_synthetic_faction(tmp_path, capsys):
+    from onepagebatch import Faction
+    files = []
+    for name in ['a', 'b']:
+        generate(str(tmp_path / name), 'Synthetic', 50, 40, 5, 30, 8, 3, 1, 7)
+        files.append([open(os.path.join(str(tmp_path / name), f)).read() for f in sorted(os.listdir(str(tmp_path / name)))])
+    assert(files[0] == files[1])
+    faction = Faction(str(tmp_path / 'a'))
+    assert(len(faction.units) == 50 and len(faction.upgrades) == 30)
+    assert('Error' not in capsys.readouterr().out)
+
+
+# Phases are timed and methods counted only when the profiler is enabled
+def test_Profiler():
+    profiler = Profiler()
+    cost = Weapon.Cost
+    with profiler.phase('disabled'):
+        Weapon('Rifle', 24, 1, 0).Cost(12, 4)
+    profiler.enable()
+    with profiler.phase('enabled'):
+        Weapon('Rifle', 24, 1, 0).Cost(12, 4)
+    profiler.disable()
+    assert(Weapon.Cost is cost)
+    assert([(name, calls) for name, calls, total in profiler.phases()] == [('enabled', 1)])
+    assert(profiler.counts == {'Weapon.Cost': 1})
+    assert(profiler.trace()['traceEvents'][0]['ph'] == 'X')
+
+
+# A pdf is rebuilt only when its .tex changed, failed jobs are retried
+def test_build_pdf(tmp_path):
+    os.makedirs(str(tmp_path / 'tex'))
+    (tmp_path / 'tex' / 'Tao.tex').write_text('tex')
+    latex = [sys.executable, '-c', 'import os, shutil, sys\nif not os.path.exists("tried"):\n    open("tried", "w").close()\n    sys.exit(1)\nshutil.copy(sys.argv[-1], "Tao.pdf")']
+    job = PdfJob('Tao', str(tmp_path), latex)
+    assert(not job.upToDate())
+    assert(runJobs([job], 1000, 500, 1) == [] and job.tries == 2)
+    assert(PdfJob('Tao', str(tmp_path), latex).upToDate())
+    (tmp_path / 'tex' / 'Tao.tex').write_text('new tex')
+    assert(not PdfJob('Tao', str(tmp_path), latex).upToDate())
+
+
+# A rebuilt faction reuses the upgrade costs, and gets the same results
+def test_upgrade_cost_cache(capsys):
+    from onepagebatch import Faction, upgrade_cost_cache
+    upgrade_cost_cache.invalidate()
+    first = [upgrade.cost for group in Faction('Tao').upgrades for upgrade in group]
+    misses = upgrade_cost_cache.misses
+    second = [upgrade.cost for group in Faction('Tao').upgrades for upgrade in group]
+    assert(first == second and upgrade_cost_cache.misses == misses)
+
+
+# Upgrade costs computed by a process pool are the same as the serial ones,
+# with the same errors, printed by the faction
+def test_upgrade_cost_executor(capsys):
+    from concurrent.futures import ProcessPoolExecutor
+    from onepagebatch import Faction, upgrade_cost_cache
+    upgrade_cost_cache.invalidate()
+    serial = [upgrade.cost for group in Faction('Battle_Brothers').upgrades for upgrade in group]
+    log = capsys.readouterr().out
+    upgrade_cost_cache.invalidate()
+    with ProcessPoolExecutor(2) as executor:
+        parallel = [upgrade.cost for group in Faction('Battle_Brothers', executor=executor).upgrades for upgrade in group]
+    assert(serial == parallel and capsys.readouterr().out == log)
+
+
+# A cached upgrade cost prints its errors again, and depends on the cost adjustments
+def test_upgrade_cost_cache_errors(capsys, monkeypatch):
+    import onepagepoints
+    from onepagebatch import Faction, Upgrade, upgrade_cost_cache
+    faction = Faction('Tao')
+    unit = faction.units[0]
+    weapon = next(w for w in faction.armory.values() if isinstance(w, Weapon) and w not in unit.equipments and not w.name.endswith('s'))
+    upgrade = Upgrade({'text': 'Replace', 'remove': [weapon.name], 'add': [[unit.equipments[0].name]]}, faction)
+    capsys.readouterr()
+    costs = upgrade.Cost_unit(unit)
+    assert('ERROR unit {},'.format(unit.name) in capsys.readouterr().out)
+    renamed = copy.copy(unit)
+    renamed.name = 'Renamed Unit'
+    assert(upgrade.Cost_unit(renamed) == costs and 'ERROR unit Renamed Unit,' in capsys.readouterr().out)
+    misses = upgrade_cost_cache.misses
+    monkeypatch.setattr(onepagepoints, 'adjust_attack_cost', 0.5)
+    weapon_cost_cache.invalidate()
+    upgrade.Cost_unit(unit)
+    weapon_cost_cache.invalidate()
+    assert(upgrade_cost_cache.misses == misses + 1)
+
+
+# The errors of a faction are printed again when its outputs come from the build cache
+def test_build_cache_log(tmp_path, capsys, monkeypatch):
+    import shutil
+    import yaml
+    from onepagecache import BuildCache
+    from onepagebatch import generateFaction
+    faction = tmp_path / 'Broken'
+    shutil.copytree('Tao', str(faction))
+    for name in ['Common', 'Template']:
+        (tmp_path / name).symlink_to(os.path.abspath(name))
+    monkeypatch.chdir(tmp_path)
+    upgrades = yaml.safe_load((faction / 'upgrades.yml').read_text())
+    upgrades[0]['upgrades'].append({'text': 'Replace Fusion Carbine', 'remove': ['Fusion Carbine'], 'add': [['Rail Rifle']]})
+    (faction / 'upgrades.yml').write_text(yaml.safe_dump(upgrades))
+    cache = BuildCache(str(tmp_path / 'cache'))
+    os.mkdir('txt')
+    generateFaction('Broken', '.', ['txt'], cache=cache)
+    errors = [line for line in capsys.readouterr().out.splitlines() if 'ERROR' in line]
+    generateFaction('Broken', '.', ['txt'], cache=cache)
+    out = capsys.readouterr().out
+    assert(errors and 'Using cached outputs' in out and [line for line in out.splitlines() if 'ERROR' in line] == errors)
+
+
+# A modified template is read again
+def test_template(tmp_path, monkeypatch):
+    from onepagebatch import template
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Template').mkdir()
+    header = tmp_path / 'Template' / 'test.tex'
+    header.write_text('old')
+    assert(template('test.tex') == 'old')
+    header.write_text('new')
+    os.utime(header, ns=(0, 1))
+    assert(template('test.tex') == 'new')
+
+
+# A redefined weapon is updated in place, with its plural and Linked variants
+def test_Armory_redefine():
+    armory = Armory()
+    armory.add([Weapon('Rifle', 24, 1, 0)])
+    rifles, linked = armory.get(['Rifles', 'Linked Rifles'])
+    armory.redefine(Weapon('Rifle', 24, 3, 1))
+    assert(armory.get(['Rifle'])[0].attacks == 3)
+    assert(rifles.name == 'Rifles' and rifles.attacks == 3 and rifles.armorPiercing == 1)
+    assert(linked.name == 'Linked Rifles' and linked.attacks == 3 and linked.weaponRules == ['Linked'])
+    assert(armory.base('Linked Rifles') == 'Rifle')
+
+
+# Only the units and upgrade options which use an equipment are invalidated
+def test_Dependencies(capsys):
+    from onepagebatch import Faction
+    faction = Faction('Tao')
+    unit = faction.units[0]
+    weapon = unit.equipments[0]
+    invalid = faction.dependencies.affected([weapon.name])
+    assert(unit.name in invalid.units)
+    options = [(g, u, o, upgrade, equipments) for g, group in enumerate(faction.upgrades)
+               for u, upgrade in enumerate(group) for o, equipments in enumerate(upgrade.add)]
+    # only added by options: these options only
+    fusion = faction.dependencies.affected(['Fusion Carbine'])
+    expected = {(g, u, o) for g, u, o, upgrade, equipments in options if 'Fusion Carbine' in [faction.armory.base(e.name) for e in equipments]}
+    assert(fusion.units == set() and len(expected) > 1 and fusion.options == expected)
+    # removed by an upgrade, and used by a unit: all the options of the groups of the unit
+    spear = faction.dependencies.affected(['Sacred Spear'])
+    spearUnits = {u.name for u in faction.units if 'Sacred Spear' in [faction.armory.base(e.name) for e in u.equipments]}
+    expected = {(g, u, o) for g, u, o, upgrade, equipments in options if set(faction.upgrades[g].units) & spearUnits}
+    assert(spear.units == spearUnits and spear.options == expected)
+    assert(any(upgrade.text == 'Replace Sacred Spear' and (g, u, o) in expected for g, u, o, upgrade, equipments in options))
+    for name in invalid.units:
+        assert(any(faction.armory.base(e.name) in invalid.equipments for e in next(u for u in faction.units if u.name == name).equipments))
+    assert(faction.dependencies.affected(['Not used']) == (set(['Not used']), set(), set()))
+    assert(faction.update() == (set(), set(), set()))
+
+
+# The server answers from the loaded factions, with the same costs as the build
+def test_PointsService(capsys):
+    from onepageserver import PointsService, unitCosts
+    service = PointsService(['Tao'])
+    unit = service.factions['Tao'].units[0]
+    assert(service.handle('POST', '/unit', '{"faction": "Tao", "unit": "%s"}' % unit.name) == (200, unitCosts(unit)))
+    status, answer = service.handle('POST', '/weapon', '{"weapon": {"range": 24, "attacks": 1, "ap": 1}, "speed": 12, "quality": 4}')
+    assert(status == 200 and answer['cost'] == Weapon('Rifle', 24, 1, 1).Cost(12, 4))
+    assert(service.handle('POST', '/unit', '{"faction": "Nope"}')[0] == 404)
+    assert(service.handle('POST', '/unit', 'not json')[0] == 400)
+    assert(service.handle('POST', '/unit', '{"faction": "Tao", "unit": {"equipment": [1]}}')[0] == 400)
+    for field in ['"count": -1', '"quality": 7', '"defense": 0']:
+        assert(service.handle('POST', '/unit', '{"faction": "Tao", "unit": {%s}}' % field)[0] == 400)
+    status, answer = service.handle('GET', '/units?faction=%54ao', '')
+    assert(status == 200 and answer[0] == unitCosts(unit))
+
+
+# Bad requests get an answer, and the connection is closed only if the body can't be skipped
+def test_PointsServer(capsys):
+    import asyncio
+    from onepageserver import PointsService, handleClient
+    service = PointsService(['Tao'])
+
+    async def ask(request):
+        server = await asyncio.start_server(lambda r, w: handleClient(service, r, w), '127.0.0.1', 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(request)
+            answer = await reader.read()
+            writer.close()
+            return answer
+
+    request = 'POST /unit HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'
+    assert(asyncio.run(ask(request.format('x').encode())).startswith(b'HTTP/1.1 400'))
+    assert(asyncio.run(ask(request.format('-1').encode())).startswith(b'HTTP/1.1 400'))
+    assert(asyncio.run(ask(request.format(2).encode() + b'\xff\xfe')).startswith(b'HTTP/1.1 400'))
+
+
+# A list costs its units and the printed cost of the chosen upgrades
+def test_ListPricer():
+    from onepagelist import ListPricer
+    pricer = ListPricer()
+    faction, units = pricer.faction('Tao')
+    unit = next(unit for unit in faction.units if unit.upgrades)
+    group = unit.upgrades[0]
+    entry = {'unit': unit.name, 'upgrades': [{'group': group.name, 'option': 0, 'times': 2}]}
+    result = pricer.price({'id': 1, 'faction': 'Tao', 'units': [entry, entry, {'unit': 'Nope'}]})
+    assert(result['cost'] == 2 * (unit.cost + 2 * group[0].cost[0]))
+    assert(result['errors'] == ['Unknown unit Nope'])
+    assert(pricer.entries.hits == 1)
+
+    # an option can't be taken more than its text allows, and "all" options are scaled with the model count
+    times = group[0].Limits(unit.count)[1] + 1
+    entry = {'unit': unit.name, 'upgrades': [{'group': group.name, 'option': 0, 'times': times}]}
+    assert(pricer.price({'faction': 'Tao', 'units': [entry]})['errors'])
+    unit, g, upgrade = next((unit, g, upgrade) for unit in faction.units for g in unit.upgrades for upgrade in g if upgrade.all and unit.count > 1)
+    entry = {'unit': unit.name, 'count': unit.count * 2, 'upgrades': [{'group': g.name, 'upgrade': g.index(upgrade), 'option': 0}]}
+    assert(pricer.price({'faction': 'Tao', 'units': [entry]})['cost'] == pricer.entryCost('Tao', {'unit': unit.name, 'count': unit.count * 2}) + 2 * upgrade.cost[0])
+
+
+# Bad units or bad json lines are reported in their own result only
+def test_ListPricer_errors():
+    import io
+    from onepagelist import ListPricer, readLists
+    pricer = ListPricer()
+    unit = pricer.faction('Tao')[0].units[0]
+    result = pricer.price({'faction': 'Tao', 'units': ['Fire Warriors', {'unit': unit.name}]})
+    assert(result['cost'] == unit.cost and len(result['errors']) == 1)
+    assert(pricer.price({'faction': 'Tao', 'units': 5})['errors'])
+    group = next(unit for unit in pricer.faction('Tao')[0].units if unit.upgrades).upgrades[0]
+    entry = {'unit': group.units[0], 'upgrades': [{'group': group.name, 'option': 0.0}]}
+    assert(pricer.price({'faction': 'Tao', 'units': [entry]})['errors'])
+    lines = io.StringIO('{"faction": "Tao"}\n{"faction": \n{"faction": "Tao", "units": []}\n')
+    results = list(pricer.priceAll(readLists(lines, 'json')))
+    assert([bool(r.get('errors')) for r in results] == [False, True, False])
+
+
+# One option alone costs the unit cost plus the option cost for this unit,
+# options on one model are applied together
+def test_LoadoutPricer(capsys):
+    from onepagebatch import Faction
+    from onepageloadout import LoadoutPricer, IllegalLoadout
+    faction = Faction('Tao')
+    pricer = LoadoutPricer(faction)
+    unit = next(unit for unit in faction.units if unit.name == 'Stealth Suits')
+    g, u = pricer.upgrades(unit)[0]
+    upgrade = faction.upgrades[g][u]
+    assert(pricer.price(unit, []) == unit.cost)
+    assert(pricer.price(unit, [(g, u, 0)]) == unit.cost + upgrade.Cost_unit(unit)[0])
+    total, each = upgrade.Limits(unit.count)
+    with pytest.raises(IllegalLoadout):
+        pricer.price(unit, [(g, u, 0)] * (each + 1))
+    loadouts = dict(pricer.loadouts(unit))
+    assert(loadouts[((g, u, 0),)] == pricer.price(unit, [(g, u, 0)]))
+    assert(len(loadouts) == len(set(loadouts)))
+
+    # a resized unit with the same name has its own states, and an update drops them
+    sized = copy.copy(unit)
+    sized.SetCount(unit.count + 1)
+    sized.SetFactionCost(faction.getFactionCost(sized))
+    assert(pricer.price(sized, []) == sized.cost != unit.cost)
+    assert(faction.update() is not None)
+    pricer.price(unit, [])
+    assert(len(pricer.states.data) == 1)
+
+
+# Options for one model are taken by different models of a unit, so their costs add up
+def test_LoadoutPricer_models(capsys):
+    from onepagebatch import Faction
+    from onepageloadout import LoadoutPricer
+    faction = Faction('High_Elf_Fleets')
+    pricer = LoadoutPricer(faction)
+    unit = next(unit for unit in faction.units if unit.name == 'Reaper Squad')
+    choices = {faction.upgrades[g][u].text: (g, u, 0) for g, u in pricer.upgrades(unit)}
+    anyone, one = choices['Replace any Swarm Missiles'], choices['Replace one Swarm Missile']
+    cost = pricer.price(unit, [anyone, one])
+    assert(cost - unit.cost == sum(pricer.price(unit, [c]) - unit.cost for c in [anyone, one]))
+    assert(pricer.price(unit, [anyone, anyone, one]) - cost == pricer.price(unit, [anyone]) - unit.cost)
+    assert(((anyone, anyone, one), pricer.price(unit, [anyone, anyone, one])) in pricer.loadouts(unit, 3))
+
+
+# The optimizer finds the same best list as a brute force search,
+# also with a free unit, and a list which costs exactly the budget
+def test_ArmyOptimizer(capsys):
+    import itertools
+    from onepagebatch import Faction
+    from onepageoptimize import ArmyOptimizer
+    faction = Faction('Tao')
+    faction.units = [unit for unit in faction.units if unit.upgrades][:4]
+
+    def bruteForce(optimizer, budget, copies=1, heroes=1):
+        loadouts = [[None] + [(optimizer.price(unit, choices), optimizer.pricer.state(unit, choices).Cost(), 'Hero' in unit.specialRules)
+                              for choices, cost in optimizer.pricer.loadouts(unit, 1)] for unit in faction.units] * copies
+        best = 0
+        for combination in itertools.product(*loadouts):
+            taken = [option for option in combination if option]
+            if sum(o[0] for o in taken) <= budget and sum(o[2] for o in taken) <= heroes:
+                best = max(best, sum(o[1] for o in taken))
+        return best
+
+    optimizer = ArmyOptimizer(faction, maxOptions=1, maxCopies=1, maxHeroes=1)
+    value, price, chosen = optimizer.solve(400)
+    assert(price <= 400 and sum(option.value for option in chosen) == value)
+    assert(value == bruteForce(optimizer, 400))
+
+    faction.units = faction.units[:2]
+    for unit in faction.units:
+        unit.cost = 0
+    optimizer = ArmyOptimizer(faction, maxOptions=1, maxCopies=1)
+    for budget in [0, 24]:
+        assert(optimizer.solve(budget)[0] == bruteForce(optimizer, budget, 1, 2))
+
+
+# Same with several options and copies of each unit, and a limited number of units
+def test_ArmyOptimizer_copies(capsys):
+    import itertools
+    from onepagebatch import Faction
+    from onepageoptimize import ArmyOptimizer
+    faction = Faction('Tao')
+    faction.units = [unit for unit in faction.units if unit.name in ['Sage', 'Grunt Captain', 'Jackals']]
+    optimizer = ArmyOptimizer(faction, maxOptions=2, maxCopies=2, maxUnits=3)
+
+    # for each unit, all the ways to take up to 2 copies, as (price, value, number of units)
+    takes = []
+    for unit in faction.units:
+        loadouts = [(optimizer.price(unit, choices), optimizer.pricer.state(unit, choices).Cost())
+                    for choices, cost in optimizer.pricer.loadouts(unit, 2)]
+        takes.append([(sum(p for p, v in copies), sum(v for p, v in copies), len(copies))
+                      for n in range(3) for copies in itertools.combinations_with_replacement(loadouts, n)])
+    for budget in [150, 300]:
+        best = max(sum(t[1] for t in c) for c in itertools.product(*takes)
+                   if sum(t[0] for t in c) <= budget and sum(t[2] for t in c) <= 3)
+        value, price, chosen = optimizer.solve(budget)
+        assert(value == best and price <= budget and len(chosen) <= 3)